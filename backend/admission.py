@@ -0,0 +1,136 @@
+# admission.py
+import math
+import os
+import threading
+import time
+
+# Messages handled at once before new ones get 429
+MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 32))
+# Per-user token bucket: sustained messages per minute and burst size
+USER_RATE_PER_MINUTE = float(os.environ.get('USER_RATE_PER_MINUTE', 20))
+USER_BURST = int(os.environ.get('USER_BURST', 5))
+# Crisis messages get their own, larger allowance and extra in-flight room on top of MAX_IN_FLIGHT
+CRISIS_RATE_PER_MINUTE = float(os.environ.get('CRISIS_RATE_PER_MINUTE', 60))
+CRISIS_BURST = int(os.environ.get('CRISIS_BURST', 10))
+CRISIS_EXTRA_IN_FLIGHT = int(os.environ.get('CRISIS_EXTRA_IN_FLIGHT', 16))
+# Classifier backlog that switches to degraded mode, and the level it must drain to
+DEGRADE_QUEUE_DEPTH = int(os.environ.get('DEGRADE_QUEUE_DEPTH', 8))
+RECOVER_QUEUE_DEPTH = int(os.environ.get('RECOVER_QUEUE_DEPTH', 2))
+# Target latency for a message; a backlog that would exceed it also degrades
+LATENCY_SLO_SECONDS = float(os.environ.get('LATENCY_SLO_SECONDS', 3.0))
+# Share of the SLO a message may spend waiting for the classifier; the rest covers the reply
+CLASSIFY_SLO_SHARE = 0.8
+
+EWMA_ALPHA = 0.2
+IDLE_BUCKET_SECONDS = 600
+
+
+class Rejected(Exception):
+    """Raised when a message is not admitted; carries the Retry-After value"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """Per-user rate limits, load shedding and degraded-mode switching for /api/message"""
+
+    def __init__(self, queue_depth, max_in_flight=MAX_IN_FLIGHT, rate_per_minute=USER_RATE_PER_MINUTE,
+                 burst=USER_BURST, crisis_rate_per_minute=CRISIS_RATE_PER_MINUTE, crisis_burst=CRISIS_BURST,
+                 crisis_extra_in_flight=CRISIS_EXTRA_IN_FLIGHT, degrade_depth=DEGRADE_QUEUE_DEPTH,
+                 recover_depth=RECOVER_QUEUE_DEPTH, slo_seconds=LATENCY_SLO_SECONDS):
+        # Callable returning the classifier backlog
+        self.queue_depth = queue_depth
+        self.max_in_flight = max_in_flight
+        self.crisis_max_in_flight = max_in_flight + crisis_extra_in_flight
+        self.degrade_depth = degrade_depth
+        self.recover_depth = recover_depth
+        self.slo_seconds = slo_seconds
+
+        self._lock = threading.Lock()
+        # crisis flag -> (tokens per second, burst, user_id -> (tokens, last refill time))
+        self._buckets = {
+            False: (rate_per_minute / 60.0, burst, {}),
+            True: (crisis_rate_per_minute / 60.0, crisis_burst, {}),
+        }
+        self._in_flight = 0
+        self._latency = {}  # stage -> EWMA seconds
+        self._degraded = False
+
+    def admit(self, user_id, crisis=False):
+        """Admit a message or raise Rejected; call release() with the result when done.
+
+        Crisis messages draw on a larger per-user allowance and may exceed
+        max_in_flight by crisis_extra_in_flight, so someone in danger is only
+        turned away under extreme load.
+        """
+        now = time.monotonic()
+        rate, burst, buckets = self._buckets[crisis]
+        limit = self.crisis_max_in_flight if crisis else self.max_in_flight
+        with self._lock:
+            tokens, last = buckets.get(user_id, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens < 1:
+                buckets[user_id] = (tokens, now)
+                raise Rejected("Too many messages, please slow down", (1 - tokens) / rate)
+
+            if self._in_flight >= limit:
+                # Roughly how long until the requests ahead finish
+                wait = self._latency.get('request', 1.0) * (self._in_flight - limit + 1)
+                raise Rejected("Server is busy, please try again shortly", wait)
+
+            buckets[user_id] = (tokens - 1, now)
+            if len(buckets) > 10000:
+                self._prune(buckets, now)
+
+            self._in_flight += 1
+        return now
+
+    def release(self, admitted_at):
+        with self._lock:
+            self._in_flight -= 1
+        self.observe('request', time.monotonic() - admitted_at)
+
+    def classify_budget(self, admitted_at):
+        """Seconds a message admitted at admitted_at may still wait for the classifier"""
+        return max(0.0, admitted_at + self.slo_seconds * CLASSIFY_SLO_SHARE - time.monotonic())
+
+    def observe(self, stage, seconds):
+        """Record how long a stage took"""
+        with self._lock:
+            previous = self._latency.get(stage)
+            self._latency[stage] = seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous)
+
+    def degraded(self):
+        """Whether to skip the classifier, switching with hysteresis on its backlog"""
+        depth = self.queue_depth()
+        with self._lock:
+            backlog_seconds = depth * self._latency.get('classify', 0.0)
+            if not self._degraded and (depth >= self.degrade_depth or backlog_seconds > self.slo_seconds):
+                self._degraded = True
+                print(f"⚠️ Classifier backlog {depth} (~{backlog_seconds:.1f}s), switching to degraded mode")
+            elif self._degraded and depth <= self.recover_depth and backlog_seconds <= self.slo_seconds / 2:
+                self._degraded = False
+                print("✅ Classifier backlog drained, back to full classification")
+            return self._degraded
+
+    def snapshot(self):
+        """Current load, for the admin load endpoint"""
+        # Re-evaluate so a drained backlog shows as recovered without waiting for a message
+        degraded = self.degraded()
+        depth = self.queue_depth()
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": depth,
+                "degraded": degraded,
+                "latency": {stage: round(seconds, 3) for stage, seconds in self._latency.items()}
+            }
+
+    def _prune(self, buckets, now):
+        # Drop users whose bucket has been idle long enough to refill completely
+        idle = [user_id for user_id, (_, last) in buckets.items() if now - last > IDLE_BUCKET_SECONDS]
+        for user_id in idle:
+            del buckets[user_id]
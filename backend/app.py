@@ -3,11 +3,21 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 import sqlite3
 import os
+import hmac
+import time
 from datetime import datetime
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import spacy
 import re
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from transformers import pipeline
+from priority_lane import PriorityLane, CRISIS, NORMAL
+from escalation import init_escalation_table, enqueue_escalation, notifier_from_env, EscalationDispatcher
+from users import UserDirectory
+from text_processing import ProcessedMessage
+from archive import init_retention_tables, read_user_messages, RetentionWorker
+from search import init_search_index, search_messages
+from admission import AdmissionController, Rejected
 
 # Initialize Flask app FIRST
 app = Flask(__name__)
@@ -82,7 +92,7 @@ def init_db():
     c.execute('''
         CREATE TABLE IF NOT EXISTS consent (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL UNIQUE,
             accepted BOOLEAN DEFAULT FALSE,
             emergency_phone TEXT,
             accepted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -114,6 +124,21 @@ def update_database_schema():
         if 'concern_confidence' not in columns:
             c.execute('ALTER TABLE messages ADD COLUMN concern_confidence REAL')
             print("Added concern_confidence column to messages table")
+        
+        # Consent upserts need one row per user; keep the latest if there are duplicates
+        c.execute("PRAGMA index_list(consent)")
+        unique_indexes = [index[1] for index in c.fetchall() if index[2]]
+        unique_columns = [
+            [info[2] for info in c.execute(f"PRAGMA index_info('{name}')").fetchall()]
+            for name in unique_indexes
+        ]
+        if ['user_id'] not in unique_columns:
+            c.execute('''
+                DELETE FROM consent
+                WHERE id NOT IN (SELECT MAX(id) FROM consent GROUP BY user_id)
+            ''')
+            c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_consent_user_id ON consent (user_id)')
+            print("Added unique user_id index to consent table")
             
         conn.commit()
         conn.close()
@@ -125,39 +150,99 @@ def update_database_schema():
 # Call initialization functions
 init_db()
 update_database_schema()
+init_escalation_table()
+init_retention_tables()
+search_available = init_search_index()
+
+# Cached user and consent lookups
+user_directory = UserDirectory()
+
+# Classifier jobs run on one priority lane so crisis messages skip the backlog
+analysis_lane = PriorityLane()
+
+# Longest a crisis message waits for the classifier before replying without it
+CRISIS_CLASSIFY_TIMEOUT = float(os.environ.get('CRISIS_CLASSIFY_TIMEOUT', 1.5))
+
+# Rate limits and load shedding for incoming messages; skips the classifier while it is backed up
+admission_controller = AdmissionController(analysis_lane.depth)
+
+# Deliver crisis alerts out of band
+escalation_dispatcher = EscalationDispatcher(notifier_from_env())
+escalation_dispatcher.start()
+
+# Move old messages to the cold archive so the hot database stays small
+retention_worker = RetentionWorker()
+retention_worker.start()
 
 # Helper functions
-def determine_severity(message_text, polarity, concern_label):
-    """Determine severity level based on sentiment and keywords"""
-    if not message_text:
-        return "SAFE"
-        
-    message_lower = message_text.lower()
-    
-    # Check for imminent risk keywords
-    imminent_keywords = [
-        'kill myself', 'end my life', 'suicide', 'want to die', 
-        'not want to live', 'end it all', 'better off dead',
-        'no reason to live', 'cant go on', 'i want to end it',
-        'harm to myself', 'harm', 'dark thoughts', 'suicidal',
-        'ending it all', 'no point living', 'give up'
-    ]
+# Check for imminent risk keywords
+IMMINENT_KEYWORDS = [
+    'kill myself', 'end my life', 'suicide', 'want to die', 
+    'not want to live', 'end it all', 'better off dead',
+    'no reason to live', 'cant go on', 'i want to end it',
+    'harm to myself', 'harm', 'dark thoughts', 'suicidal',
+    'ending it all', 'no point living', 'give up'
+]
 
-    # Check for self-harm keywords
-    self_harm_keywords = [
-        'cut myself', 'self harm', 'hurt myself', 'self injury',
-        'bleeding myself', 'burn myself', 'self destructive',
-        'cutting', 'self-harm', 'self harm', 'hurting myself'
-    ]
+# Check for self-harm keywords
+SELF_HARM_KEYWORDS = [
+    'cut myself', 'self harm', 'hurt myself', 'self injury',
+    'bleeding myself', 'burn myself', 'self destructive',
+    'cutting', 'self-harm', 'self harm', 'hurting myself'
+]
 
-    distressed_keywords = [
-          'hopeless', 'helpless', 'worthless', 'empty inside',
-        'cant cope', 'dont want to wake up', 'tired of living',
-        'overwhelmed', 'anxious', 'stressed', 'burned out',
-        'cant take it', 'cant do this', 'losing control'
-    ]
+DISTRESSED_KEYWORDS = [
+    'hopeless', 'helpless', 'worthless', 'empty inside',
+    'cant cope', 'dont want to wake up', 'tired of living',
+    'overwhelmed', 'anxious', 'stressed', 'burned out',
+    'cant take it', 'cant do this', 'losing control'
+]
+
+CRISIS_KEYWORDS = IMMINENT_KEYWORDS + SELF_HARM_KEYWORDS + DISTRESSED_KEYWORDS
+
+# Imminent-risk and self-harm keywords specific enough to alert an emergency contact;
+# "harm", "give up" and "cutting" are too common in everyday chat ("give up smoking")
+URGENT_CRISIS_KEYWORDS = [
+    keyword for keyword in IMMINENT_KEYWORDS + SELF_HARM_KEYWORDS
+    if keyword not in ('harm', 'give up', 'cutting')
+]
+
+# Whole-word match, so "harm to myself" counts but "pharmacy" doesn't
+URGENT_CRISIS_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(re.escape(keyword) for keyword in URGENT_CRISIS_KEYWORDS) + r')\b'
+)
+
+def process_message(message):
+    """Wrap message text in a ProcessedMessage (already processed messages pass through)"""
+    if isinstance(message, ProcessedMessage):
+        return message
+    return ProcessedMessage(message, nlp, sentiment_analyzer)
+
+def has_crisis_keywords(message):
+    """Check for crisis keywords; these alone make a message IMMINENT"""
+    message = process_message(message)
+    if 'crisis' not in message.keyword_hits:
+        message.keyword_hits['crisis'] = message.contains_any(CRISIS_KEYWORDS)
+    return message.keyword_hits['crisis']
+
+def has_urgent_crisis_keywords(message):
+    """Check for urgent crisis keywords as whole words.
+
+    These, not the broader has_crisis_keywords, decide escalation to the
+    emergency contact, crisis lane priority and crisis admission.
+    """
+    message = process_message(message)
+    if 'urgent' not in message.keyword_hits:
+        message.keyword_hits['urgent'] = URGENT_CRISIS_PATTERN.search(message.lower) is not None
+    return message.keyword_hits['urgent']
+
+def determine_severity(message, polarity, concern_label):
+    """Determine severity level based on sentiment and keywords"""
+    message = process_message(message)
+    if not message:
+        return "SAFE"
     
-    if any(keyword in message_lower for keyword in imminent_keywords + self_harm_keywords + distressed_keywords):
+    if has_crisis_keywords(message):
         return "IMMINENT"
     
     # Check sentiment-based severity
@@ -170,9 +255,10 @@ def determine_severity(message_text, polarity, concern_label):
     else:
         return "SAFE"
 
-def classify_concern(message_text):
+def classify_concern(message):
     """Classify mental health concerns using zero-shot classification"""
-    if not classifier or not message_text:
+    message = process_message(message)
+    if not classifier or not message:
         return "safe", 0.0
     
     # Define mental health concern categories
@@ -197,7 +283,7 @@ def classify_concern(message_text):
     
     try:
         # Classify the message
-        result = classifier(message_text, candidate_labels)
+        result = classifier(message.text, candidate_labels)
         
         # Get the top classification
         top_label = result['labels'][0]
@@ -235,8 +321,70 @@ def classify_concern(message_text):
         print(f"❌ Classification error: {e}")
         return "safe", 0.0
 
+# Keywords for each concern when the classifier is skipped, checked in order
+DEGRADED_CONCERN_KEYWORDS = [
+    ("suicidal", IMMINENT_KEYWORDS),
+    ("self-harm", SELF_HARM_KEYWORDS),
+    ("depression", ['depressed', 'depression', 'hopeless', 'worthless', 'empty inside', 'lonely',
+                    'loneliness', 'numb', 'grief', 'grieving', 'trauma', 'no motivation']),
+    ("anxiety", ['anxious', 'anxiety', 'panic', 'worried', 'nervous', 'scared', 'cant sleep',
+                 'insomnia', 'overthinking']),
+    ("stress", ['stress', 'overwhelmed', 'burned out', 'burnout', 'pressure', 'deadline',
+                'exam', 'workload', 'too much work']),
+    ("relationship", ['boyfriend', 'girlfriend', 'partner', 'breakup', 'broke up', 'divorce',
+                      'husband', 'wife', 'my parents', 'my family', 'my mom', 'my dad'])
+]
+
+def classify_concern_degraded(message):
+    """Keyword and VADER-only stand-in for classify_concern while the classifier is backed up"""
+    message = process_message(message)
+    if not message:
+        return "safe", 0.0
+
+    # More negative messages get more confident labels, on the same 0.5 bar as the classifier
+    confidence = 0.5 + 0.5 * max(0.0, -message.sentiment_scores['compound'])
+    for label, keywords in DEGRADED_CONCERN_KEYWORDS:
+        if message.contains_any(keywords):
+            if confidence > 0.5:
+                return label, confidence
+            break
+    return "safe", confidence
+
+def timed_classify_concern(message):
+    """Run classify_concern and record how long it took for admission control"""
+    started = time.perf_counter()
+    try:
+        return classify_concern(message)
+    finally:
+        admission_controller.observe('classify', time.perf_counter() - started)
+
+def classify_concern_in_lane(message, crisis=False, timeout=None):
+    """Classify on the analysis lane, waiting at most timeout seconds for the classifier.
+
+    Crisis messages jump the queue and wait no longer than CRISIS_CLASSIFY_TIMEOUT.
+    While the lane is backed up, or when the wait runs out, messages are
+    classified from keywords and sentiment instead.
+    """
+    if admission_controller.degraded():
+        return classify_concern_degraded(message)
+
+    priority = NORMAL
+    if crisis:
+        priority = CRISIS
+        timeout = CRISIS_CLASSIFY_TIMEOUT if timeout is None else min(timeout, CRISIS_CLASSIFY_TIMEOUT)
+
+    future = analysis_lane.submit(timed_classify_concern, message, priority=priority)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # Don't keep the user waiting past the latency target; drop the job if it hasn't started
+        future.cancel()
+        print("⚠️ Classifier busy, classifying message from keywords")
+        return classify_concern_degraded(message)
+
 def analyze_emotional_tone(message):
     """Analyze emotional tone beyond basic polarity"""
+    message = process_message(message)
     if not message:
         return {
             "polarity": 0.0,
@@ -246,7 +394,7 @@ def analyze_emotional_tone(message):
             "neutral_score": 1.0
         }
         
-    sentiment_scores = sentiment_analyzer.polarity_scores(message)
+    sentiment_scores = message.sentiment_scores
     
     # Categorize emotional tone
     if sentiment_scores['compound'] <= -0.7:
@@ -268,6 +416,11 @@ def analyze_emotional_tone(message):
         "neutral_score": sentiment_scores['neu']
     }
 
+def get_oldest_hot_message_id(cursor, user_id):
+    """Lowest message id still in SQLite for a user; archived messages are all older"""
+    cursor.execute('SELECT MIN(id) FROM messages WHERE user_id = ?', (user_id,))
+    return cursor.fetchone()[0]
+
 def get_recent_conversation(user_id, limit=5):
     """Get recent conversation history"""
     try:
@@ -299,15 +452,17 @@ def get_entity_label(entity_type):
     }
     return labels.get(entity_type, entity_type)
 
-def extract_names_with_patterns(message_text):
+# Simple pattern for capitalized words (not at sentence start)
+NAME_PATTERN = re.compile(r'(?<!\.\s)(?<!^)(?<!\n)(?<!\w\. )\b([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)\b')
+
+def extract_names_with_patterns(message):
     """Extract possible person names using regex patterns"""
-    if not message_text:
+    message = process_message(message)
+    if not message:
         return []
         
     try:
-        # Simple pattern for capitalized words (not at sentence start)
-        pattern = r'(?<!\.\s)(?<!^)(?<!\n)(?<!\w\. )\b([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)\b'
-        matches = re.findall(pattern, message_text)
+        matches = NAME_PATTERN.findall(message.text)
         names = []
         for name in matches:
             # Avoid duplicates and very short names
@@ -322,66 +477,78 @@ def extract_names_with_patterns(message_text):
         print(f"Error in extract_names_with_patterns: {e}")
         return []
 
-def extract_mental_health_keywords(message_text):
+# Expanded mental health contexts
+MENTAL_HEALTH_TERMS = {
+    "work": ["work", "job", "career", "boss", "colleague", "office", "employment", "workplace", "unemployment", "job stress", "job pressure", "work stress", "work pressure", "burnout"],
+    "school": ["school", "college", "university", "exam", "test", "homework", "studies", "academic", "grades", "gpa", "professor", "teacher", "class", "assignment", "project", "thesis", "dissertation", "student", "student life", "school stress", "academic pressure"],
+    "family": ["family", "parent", "mother", "father", "sibling", "child", "mom", "dad", "brother", "sister", "relative", "sista", "bro", "cousin"],
+    "relationship": ["partner", "boyfriend", "girlfriend", "spouse", "relationship", "dating", "marriage", "divorce", "breakup", "ex", "significant other", "fiance", "fiancee", "lover", "hubby", "wifey", "husband", "wife", "gf", "bf", "romantic"],
+    "friends": ["friend", "friends", "friendship", "buddy", "pal", "social circle", "companions", "mate", "bff", "bestie", "best friend", "close friend", "close friends", "friend group", "bro"],
+    "social": ["social", "social life", "isolation", "lonely", "alone", "isolated"],
+    "health": ["health", "doctor", "therapy", "medication", "treatment", "hospital", "clinic", "illness", "sick", "chronic", "condition", "disorder", "disease", "physical health", "mental health treatment", "therapy sessions", "therapist", "psychiatrist"],
+    "financial": ["money", "financial", "bill", "debt", "expensive", "cost", "payment", "salary", "income", "expenses", "budget", "savings", "financial stress", "financial pressure", "broke", "poverty", "unemployed", "unemployment", "jobless"],
+    "future": ["future", "career", "goals", "dreams", "aspirations", "plans", "uncertain", "uncertainty", "unknown", "goals", "ambitions", "hopes", "fears about future"],
+    "self_esteem": ["confidence", "self-esteem", "self worth", "insecurity", "insecure"],
+    "trauma": ["trauma", "abuse", "ptsd", " traumatic", "past experiences", "flashbacks", "nightmares", "assault", "harassment", "victim", "survivor", "molestation", "rape", "childhood trauma", "abuse"],
+    "grief": ["grief", "loss", "mourning", "bereavement", "died", "passed away", "funeral", "loss of loved one", "loss of family member", "loss of friend"],
+    "substance": ["alcohol", "drugs", "substance", "addiction", "drink", "smoke", "smoking", "drug use", "rehab", "detox", "substance abuse", "alcoholism", "drug addiction", "overdose","cutting", "burning"],
+    "mental_health": ["depression", "anxiety", "stress", "panic attack", "mental health", "bipolar", "schizophrenia", "ocd", "ptsd", "adhd", "autism", "eating disorder", "self-harm", "suicidal thoughts","cutting", "burning", "sh"],
+    "emotions": ["anger", "frustration", "sadness", "loneliness", "fear", "guilt", "shame", "jealousy", "envy", "resentment", "grief", "disappointment", "hopelessness", "helplessness", "overwhelmed", "numb"]
+}
+
+# Word-boundary patterns for each term, compiled once
+MENTAL_HEALTH_PATTERNS = {
+    category: [re.compile(r'\b' + re.escape(term) + r'\b') for term in terms]
+    for category, terms in MENTAL_HEALTH_TERMS.items()
+}
+
+def extract_mental_health_keywords(message):
     """Extract mental health related keywords"""
-    if not message_text:
+    message = process_message(message)
+    if not message:
         return []
+    
+    if 'mental_health' in message.keyword_hits:
+        return list(message.keyword_hits['mental_health'])
         
     keywords = []
-    message_lower = message_text.lower()
-    
-    # Expanded mental health contexts
-    mental_health_terms = {
-        "work": ["work", "job", "career", "boss", "colleague", "office", "employment", "workplace", "unemployment", "job stress", "job pressure", "work stress", "work pressure", "burnout"],
-        "school": ["school", "college", "university", "exam", "test", "homework", "studies", "academic", "grades", "gpa", "professor", "teacher", "class", "assignment", "project", "thesis", "dissertation", "student", "student life", "school stress", "academic pressure"],
-        "family": ["family", "parent", "mother", "father", "sibling", "child", "mom", "dad", "brother", "sister", "relative", "sista", "bro", "cousin"],
-        "relationship": ["partner", "boyfriend", "girlfriend", "spouse", "relationship", "dating", "marriage", "divorce", "breakup", "ex", "significant other", "fiance", "fiancee", "lover", "hubby", "wifey", "husband", "wife", "gf", "bf", "romantic"],
-        "friends": ["friend", "friends", "friendship", "buddy", "pal", "social circle", "companions", "mate", "bff", "bestie", "best friend", "close friend", "close friends", "friend group", "bro"],
-        "social": ["social", "social life", "isolation", "lonely", "alone", "isolated"],
-        "health": ["health", "doctor", "therapy", "medication", "treatment", "hospital", "clinic", "illness", "sick", "chronic", "condition", "disorder", "disease", "physical health", "mental health treatment", "therapy sessions", "therapist", "psychiatrist"],
-        "financial": ["money", "financial", "bill", "debt", "expensive", "cost", "payment", "salary", "income", "expenses", "budget", "savings", "financial stress", "financial pressure", "broke", "poverty", "unemployed", "unemployment", "jobless"],
-        "future": ["future", "career", "goals", "dreams", "aspirations", "plans", "uncertain", "uncertainty", "unknown", "goals", "ambitions", "hopes", "fears about future"],
-        "self_esteem": ["confidence", "self-esteem", "self worth", "insecurity", "insecure"],
-        "trauma": ["trauma", "abuse", "ptsd", " traumatic", "past experiences", "flashbacks", "nightmares", "assault", "harassment", "victim", "survivor", "molestation", "rape", "childhood trauma", "abuse"],
-        "grief": ["grief", "loss", "mourning", "bereavement", "died", "passed away", "funeral", "loss of loved one", "loss of family member", "loss of friend"],
-        "substance": ["alcohol", "drugs", "substance", "addiction", "drink", "smoke", "smoking", "drug use", "rehab", "detox", "substance abuse", "alcoholism", "drug addiction", "overdose","cutting", "burning"],
-        "mental_health": ["depression", "anxiety", "stress", "panic attack", "mental health", "bipolar", "schizophrenia", "ocd", "ptsd", "adhd", "autism", "eating disorder", "self-harm", "suicidal thoughts","cutting", "burning", "sh"],
-        "emotions": ["anger", "frustration", "sadness", "loneliness", "fear", "guilt", "shame", "jealousy", "envy", "resentment", "grief", "disappointment", "hopelessness", "helplessness", "overwhelmed", "numb"]
-    }
     
     try:
-        for category, terms in mental_health_terms.items():
-            for term in terms:
+        for category, patterns in MENTAL_HEALTH_PATTERNS.items():
+            for pattern in patterns:
                 # Use word boundaries to avoid partial matches
-                pattern = r'\b' + re.escape(term) + r'\b'
-                if re.search(pattern, message_lower):
+                match = pattern.search(message.lower)
+                if match:
                     # Find the actual word used (for proper capitalization)
-                    match = re.search(pattern, message_text, re.IGNORECASE)
-                    if match:
-                        # Check if we haven't already added this category
-                        if not any(k['label'] == category.title() for k in keywords):
-                            keywords.append({
-                                "text": match.group(),
-                                "type": "KEYWORD", 
-                                "label": category.title()
-                            })
+                    text = message.original(*match.span())
+                    if text is None:
+                        original_match = re.search(pattern.pattern, message.text, re.IGNORECASE)
+                        text = original_match.group() if original_match else None
+                    if text is not None:
+                        keywords.append({
+                            "text": text,
+                            "type": "KEYWORD", 
+                            "label": category.title()
+                        })
                     break  # Only add one keyword per category
     except Exception as e:
         print(f"Error in extract_mental_health_keywords: {e}")
     
-    return keywords
+    message.keyword_hits['mental_health'] = keywords
+    return list(keywords)
 
-def extract_entities(message_text):
+def extract_entities(message):
     """Extract named entities from message text"""
+    message = process_message(message)
     entities = []
     
-    if not message_text or not message_text.strip():
+    if not message or not message.text.strip():
         return entities
 
     try:
         # Extract entities using spaCy if available
-        if nlp:
-            doc = nlp(message_text)
+        doc = message.doc
+        if doc is not None:
             for ent in doc.ents:
                 # Filter for relevant entity types
                 if ent.label_ in ["PERSON", "ORG", "GPE", "EVENT", "DATE", "TIME"]:
@@ -392,11 +559,11 @@ def extract_entities(message_text):
                     })
         
         # Extract mental health keywords
-        mental_health_keywords = extract_mental_health_keywords(message_text)
+        mental_health_keywords = extract_mental_health_keywords(message)
         entities.extend(mental_health_keywords)
     
         # Extract names using patterns
-        additional_names = extract_names_with_patterns(message_text)
+        additional_names = extract_names_with_patterns(message)
         entities.extend(additional_names)
         
     except Exception as e:
@@ -406,26 +573,25 @@ def extract_entities(message_text):
 
 def generate_bot_reply(user_message, severity="SAFE"):
     """Generate friendly, supportive bot replies"""
+    user_message = process_message(user_message)
     if not user_message:
         return "I'm here to listen. Could you share what's on your mind?"
-        
-    user_message_lower = user_message.lower()
     
     # More comprehensive responses
-    if any(word in user_message_lower for word in ['lonely', 'alone', 'isolated']):
+    if user_message.contains_any(['lonely', 'alone', 'isolated']):
         return "Feeling lonely can be really painful. That sense of isolation must be difficult. Would you like to talk about what's making you feel alone right now?"
     
-    elif any(word in user_message_lower for word in ['overwhelmed', 'too much', 'cant handle']):
+    elif user_message.contains_any(['overwhelmed', 'too much', 'cant handle']):
         return "When everything feels overwhelming, it can help to break things down. What's feeling like the most pressing thing right now?"
     
-    elif any(word in user_message_lower for word in ['hopeless', 'pointless', 'nothing matters']):
+    elif user_message.contains_any(['hopeless', 'pointless', 'nothing matters']):
         return "Hopelessness can make everything feel heavy. I'm really glad you're reaching out despite feeling this way. Can you tell me more about what's contributing to these feelings?"
     
-    elif any(word in user_message_lower for word in ['sleep', 'insomnia', 'cant sleep']):
+    elif user_message.contains_any(['sleep', 'insomnia', 'cant sleep']):
         return "Sleep struggles can really impact everything else. That sounds exhausting. How long has your sleep been affected?"
     
     # Add follow-up questions for better conversation flow
-    if "?" in user_message:
+    if "?" in user_message.text:
         return "That's an important question. While I can offer support, for specific advice it's best to consult a mental health professional. How are you feeling about this situation?"
     
     # Custom responses based on severity
@@ -436,22 +602,22 @@ def generate_bot_reply(user_message, severity="SAFE"):
         return "I can hear that you're going through something really difficult right now. Thank you for reaching out. Would you like to talk more about what's making you feel this way? I'm here to listen."
     
     # Simple keyword-based responses
-    if any(word in user_message_lower for word in ['sad', 'depressed', 'unhappy', 'down']):
+    if user_message.contains_any(['sad', 'depressed', 'unhappy', 'down']):
         return "I'm really sorry you're feeling this way. It takes courage to share these feelings. Would you like to talk more about what's bothering you?"
     
-    elif any(word in user_message_lower for word in ['anxious', 'nervous', 'worried', 'stress']):
+    elif user_message.contains_any(['anxious', 'nervous', 'worried', 'stress']):
         return "I understand anxiety can be overwhelming. Let's take a moment to breathe together. What specifically is causing you stress right now?"
     
-    elif any(word in user_message_lower for word in ['angry', 'mad', 'frustrated', 'upset']):
+    elif user_message.contains_any(['angry', 'mad', 'frustrated', 'upset']):
         return "It's completely normal to feel angry sometimes. Would it help to talk about what triggered these feelings?"
     
-    elif any(word in user_message_lower for word in ['hello', 'hi', 'hey', 'start']):
+    elif user_message.contains_any(['hello', 'hi', 'hey', 'start']):
         return "Hello! I'm here to listen and support you. How are you feeling today?"
     
-    elif any(word in user_message_lower for word in ['help', 'support', 'need help']):
+    elif user_message.contains_any(['help', 'support', 'need help']):
         return "I'm here for you. You're not alone in this. Can you tell me more about what kind of support you're looking for?"
     
-    elif any(word in user_message_lower for word in ['thank', 'thanks', 'appreciate']):
+    elif user_message.contains_any(['thank', 'thanks', 'appreciate']):
         return "You're very welcome! I'm glad I can be here for you. Remember, reaching out is a sign of strength."
     
     # Default empathetic responses
@@ -463,10 +629,9 @@ def generate_bot_reply_with_entities(user_message, severity="SAFE", entities=Non
     if entities is None:
         entities = []
     
+    user_message = process_message(user_message)
     if not user_message:
         return "I'm here to listen. Could you share what's on your mind?"
-        
-    user_message_lower = user_message.lower()
     
     # Crisis responses first
     if severity == "IMMINENT":
@@ -529,10 +694,10 @@ def generate_bot_reply_with_entities(user_message, severity="SAFE", entities=Non
         return "How we feel about ourselves can deeply impact our daily life. It sounds like you're struggling with self-worth right now. Those feelings can be really painful. Would you like to explore what's affecting your self-esteem?"
     
     # Existing keyword-based responses
-    if any(word in user_message_lower for word in ['sad', 'depressed', 'unhappy', 'down']):
+    if user_message.contains_any(['sad', 'depressed', 'unhappy', 'down']):
         return "I'm really sorry you're feeling this way. It takes courage to share these feelings. Would you like to talk more about what's bothering you?"
     
-    elif any(word in user_message_lower for word in ['anxious', 'nervous', 'worried', 'stress']):
+    elif user_message.contains_any(['anxious', 'nervous', 'worried', 'stress']):
         return "I understand anxiety can be overwhelming. Let's take a moment to breathe together. What specifically is causing you stress right now?"
     
     # Default empathetic response
@@ -540,6 +705,7 @@ def generate_bot_reply_with_entities(user_message, severity="SAFE", entities=Non
 
 def generate_bot_reply_with_context(user_message, severity, entities, concern_label, confidence):
     """Generate bot replies considering concern classification"""
+    user_message = process_message(user_message)
     if not user_message:
         return "I'm here to listen. Could you share what's on your mind?"
     
@@ -575,6 +741,33 @@ def generate_bot_reply_with_context(user_message, severity, entities, concern_la
     # Fall back to entity-aware responses
     return generate_bot_reply_with_entities(user_message, severity, entities)
 
+def parse_user_id(value):
+    """Convert a user ID from a request to an int, or None if it isn't one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def is_admin_request():
+    """Check the X-Admin-Token header; admin routes stay closed unless ADMIN_TOKEN is set"""
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token)
+
+def split_param(name):
+    """Read a comma-separated query parameter as a list"""
+    value = request.args.get(name, '')
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def is_valid_date(value):
+    """Check a 'YYYY-MM-DD' date parameter"""
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
 # Routes
 @app.route('/api/ping', methods=['GET'])
 def ping():
@@ -592,23 +785,9 @@ def login():
         if not email:
             return jsonify({"error": "Email is required"}), 400
         
-        conn = sqlite3.connect('mindpeers.db')
-        c = conn.cursor()
-        
-        # Check if user exists
-        c.execute('SELECT id, email FROM users WHERE email = ?', (email,))
-        user = c.fetchone()
-        
-        if not user:
-            # Create new user
-            c.execute('INSERT INTO users (email) VALUES (?)', (email,))
-            user_id = c.lastrowid
-            print(f"✅ New user created: {email} (ID: {user_id})")
-        else:
-            user_id = user[0]
-            print(f"✅ Existing user logged in: {email} (ID: {user_id})")
-        
-        conn.commit()
+        # Get or create the user in one statement
+        user_id = user_directory.login(email)
+        print(f"✅ User logged in: {email} (ID: {user_id})")
         
         return jsonify({
             "user_id": user_id,
@@ -619,9 +798,6 @@ def login():
     except Exception as e:
         print(f"❌ Login error: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 @app.route('/api/consent', methods=['POST'])
 def consent():
@@ -630,36 +806,18 @@ def consent():
         if not data:
             return jsonify({"error": "No JSON data received"}), 400
             
-        user_id = data.get('user_id')
+        user_id = parse_user_id(data.get('user_id'))
         emergency_phone = data.get('emergency_phone', '')
         
         if not user_id:
             return jsonify({"error": "User ID is required"}), 400
         
-        conn = sqlite3.connect('mindpeers.db')
-        c = conn.cursor()
+        if not user_directory.user_exists(user_id):
+            return jsonify({"error": "Unknown user"}), 404
         
-        # Check if consent already exists
-        c.execute('SELECT id FROM consent WHERE user_id = ?', (user_id,))
-        existing_consent = c.fetchone()
-        
-        if existing_consent:
-            # Update existing consent
-            c.execute('''
-                UPDATE consent 
-                SET accepted = TRUE, emergency_phone = ?, accepted_at = ?
-                WHERE user_id = ?
-            ''', (emergency_phone, datetime.now(), user_id))
-            print(f"✅ Consent updated for user ID: {user_id}")
-        else:
-            # Create new consent
-            c.execute('''
-                INSERT INTO consent (user_id, accepted, emergency_phone)
-                VALUES (?, TRUE, ?)
-            ''', (user_id, emergency_phone))
-            print(f"✅ Consent created for user ID: {user_id}")
-        
-        conn.commit()
+        # Create or update consent in one statement
+        user_directory.record_consent(user_id, emergency_phone)
+        print(f"✅ Consent recorded for user ID: {user_id}")
         
         return jsonify({
             "message": "Consent recorded successfully",
@@ -669,9 +827,6 @@ def consent():
     except Exception as e:
         print(f"❌ Consent error: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 
 @app.route('/api/trend/<user_id>', methods=['GET'])
@@ -681,16 +836,25 @@ def get_sentiment_trend(user_id):
         conn = sqlite3.connect('mindpeers.db')
         c = conn.cursor()
         
+        # The oldest messages live in the archive, so read it first
+        archived = read_user_messages(
+            user_id, 20,
+            predicate=lambda r: not r['is_bot'] and r['polarity'] is not None,
+            before_id=get_oldest_hot_message_id(c, user_id)
+        )
+        messages = [(r['message_text'], r['polarity'], r['created_at']) for r in archived]
+        
         # Get last 20 messages with polarity and timestamps - ORDER BY ASC for chronological order
-        c.execute('''
-            SELECT message_text, polarity, created_at 
-            FROM messages 
-            WHERE user_id = ? AND is_bot = FALSE AND polarity IS NOT NULL
-            ORDER BY created_at ASC  -- CHANGED FROM DESC TO ASC
-            LIMIT 20
-        ''', (user_id,))
+        if len(messages) < 20:
+            c.execute('''
+                SELECT message_text, polarity, created_at 
+                FROM messages 
+                WHERE user_id = ? AND is_bot = FALSE AND polarity IS NOT NULL
+                ORDER BY created_at ASC  -- CHANGED FROM DESC TO ASC
+                LIMIT ?
+            ''', (user_id, 20 - len(messages)))
+            messages.extend(c.fetchall())
         
-        messages = c.fetchall()
         conn.close()
         
         # Process data for frontend
@@ -727,14 +891,70 @@ def get_sentiment_trend(user_id):
         print(f"❌ Trend error: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
+@app.route('/api/admin/search', methods=['GET'])
+def admin_search():
+    """Full-text search over messages for moderators"""
+    try:
+        if not is_admin_request():
+            return jsonify({"error": "Admin access required"}), 403
+        
+        if not search_available:
+            return jsonify({"error": "Search is not available"}), 503
+        
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "Search query is required"}), 400
+        
+        user_id = request.args.get('user_id')
+        if user_id is not None:
+            user_id = parse_user_id(user_id)
+            if not user_id:
+                return jsonify({"error": "Invalid user ID"}), 400
+        
+        date_from = request.args.get('from')
+        date_to = request.args.get('to')
+        for value in (date_from, date_to):
+            if value and not is_valid_date(value):
+                return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+        
+        results = search_messages(
+            query,
+            severity=split_param('severity'),
+            concern_label=split_param('concern'),
+            user_id=user_id,
+            date_from=date_from,
+            date_to=date_to,
+            include_bot=request.args.get('include_bot') == 'true',
+            limit=request.args.get('limit', 20, type=int),
+            offset=request.args.get('offset', 0, type=int)
+        )
+        
+        return jsonify({
+            "query": query,
+            "count": len(results),
+            "results": results
+        })
+        
+    except Exception as e:
+        print(f"❌ Search error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/load', methods=['GET'])
+def admin_load():
+    """Admission control state: in-flight messages, classifier backlog and stage latencies"""
+    if not is_admin_request():
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(admission_controller.snapshot())
+
 @app.route('/api/message', methods=['POST'])
 def handle_message():
+    admitted_at = None
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "No JSON data received"}), 400
             
-        user_id = data.get('user_id')
+        user_id = parse_user_id(data.get('user_id'))
         message_text = data.get('message_text')
         
         print(f"📨 Received message from user {user_id}: {message_text}")
@@ -742,22 +962,41 @@ def handle_message():
         if not user_id or not message_text:
             return jsonify({"error": "User ID and message text are required"}), 400
         
+        # Served from the user directory cache, so no extra query per message
+        if not user_directory.has_consented(user_id):
+            return jsonify({"error": "Consent is required before chatting"}), 403
+        
+        # Lowercase, tokenize and parse the message once for every analyzer
+        message = process_message(message_text)
+        
+        # Urgent keywords don't need the classifier, so check them before queueing
+        urgent = has_urgent_crisis_keywords(message)
+        
+        # Imminent-risk and self-harm messages get a larger allowance before being turned away
+        try:
+            admitted_at = admission_controller.admit(user_id, urgent)
+        except Rejected as e:
+            print(f"⏳ Rejected message from user {user_id}: {e.reason}")
+            return jsonify({"error": e.reason, "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+        
         # Analyze sentiment
-        sentiment_scores = sentiment_analyzer.polarity_scores(message_text)
+        sentiment_scores = message.sentiment_scores
         polarity = sentiment_scores['compound']
         
         print(f"📊 Sentiment analysis: {polarity}")
 
         # Classify concern
-        concern_label, concern_confidence = classify_concern(message_text)
+        concern_label, concern_confidence = classify_concern_in_lane(
+            message, urgent, admission_controller.classify_budget(admitted_at)
+        )
         print(f"🎯 Concern classification: {concern_label} (confidence: {concern_confidence:.2f})")
 
         # Determine severity
-        severity = determine_severity(message_text, polarity, concern_label)
+        severity = determine_severity(message, polarity, concern_label)
         print(f"🚨 Severity level: {severity}")
 
         # Extract entities
-        entities = extract_entities(message_text)
+        entities = extract_entities(message)
         print(f"🔍 Extracted entities: {entities}")
 
         conn = sqlite3.connect('mindpeers.db')
@@ -771,6 +1010,12 @@ def handle_message():
         
         user_message_id = c.lastrowid
         
+        # Record the escalation in the same transaction so it can't be lost; only urgent
+        # keywords alert the emergency contact, not every IMMINENT-rated message
+        escalation_id = None
+        if urgent:
+            escalation_id = enqueue_escalation(c, user_id, user_message_id, severity, user_directory.get_emergency_phone(user_id))
+        
         # Save extracted entities (only if entities exist)
         if entities:
             for entity in entities:
@@ -780,7 +1025,7 @@ def handle_message():
                 ''', (user_message_id, entity.get('text', ''), entity.get('label', '')))
         
         # Generate bot reply
-        bot_reply = generate_bot_reply_with_context(message_text, severity, entities, concern_label, concern_confidence)
+        bot_reply = generate_bot_reply_with_context(message, severity, entities, concern_label, concern_confidence)
         
         print(f"🤖 Bot reply: {bot_reply}")
 
@@ -793,6 +1038,10 @@ def handle_message():
         conn.commit()
         conn.close()
         
+        if escalation_id:
+            print(f"🚨 Escalation {escalation_id} queued for user ID: {user_id}")
+            escalation_dispatcher.wake()
+        
         return jsonify({
             "bot_reply": bot_reply,
             "analysis": {
@@ -812,6 +1061,9 @@ def handle_message():
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
+    finally:
+        if admitted_at is not None:
+            admission_controller.release(admitted_at)
 
 if __name__ == '__main__':
     print("🚀 Starting MindPeers backend server...")
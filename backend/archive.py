@@ -0,0 +1,278 @@
+# archive.py
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Messages older than this move out of SQLite into the cold archive
+RETENTION_DAYS = int(os.environ.get('MESSAGE_RETENTION_DAYS', 90))
+ARCHIVE_DIR = os.environ.get('MESSAGE_ARCHIVE_DIR', os.path.join('archive', 'messages'))
+# Stays under the 999 bound variables older SQLite builds allow
+BATCH_SIZE = 900
+# Gap between batches so request handlers (and other archivers) get the write lock
+BATCH_PAUSE_SECONDS = 0.2
+
+MESSAGE_COLUMNS = ['id', 'user_id', 'message_text', 'is_bot', 'polarity', 'severity',
+                   'concern_label', 'concern_confidence', 'created_at']
+
+# Threads in one process queue here rather than on SQLite's busy timeout
+_write_lock = threading.Lock()
+
+
+def init_retention_tables(db_path='mindpeers.db'):
+    """Create the rollup table and the indexes retention and history reads rely on"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    # Daily per-user totals that outlive the archived messages
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS message_rollups (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            user_message_count INTEGER NOT NULL DEFAULT 0,
+            polarity_sum REAL NOT NULL DEFAULT 0,
+            polarity_count INTEGER NOT NULL DEFAULT 0,
+            safe_count INTEGER NOT NULL DEFAULT 0,
+            elevated_count INTEGER NOT NULL DEFAULT 0,
+            distressed_count INTEGER NOT NULL DEFAULT 0,
+            imminent_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages (user_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_entities_message_id ON entities (message_id)')
+    conn.commit()
+    conn.close()
+
+
+def _partition_paths(partition, archive_dir):
+    base = os.path.join(archive_dir, partition)
+    return base + '.ndjson.gz', base + '.index.json'
+
+
+def _load_index(index_path):
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"rows": 0, "users": {}, "members": []}
+
+
+def _append_member(partition, records, archive_dir):
+    """Append records to a partition as one gzip member and index it"""
+    data_path, index_path = _partition_paths(partition, archive_dir)
+    payload = gzip.compress(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+
+    with open(data_path, 'ab') as f:
+        offset = f.tell()
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    users = sorted({str(record['user_id']) for record in records})
+    index = _load_index(index_path)
+    index["rows"] += len(records)
+    for record in records:
+        user = str(record['user_id'])
+        index["users"][user] = index["users"].get(user, 0) + 1
+    index["members"].append({
+        "offset": offset,
+        "length": len(payload),
+        "rows": len(records),
+        "min_id": records[0]['id'],
+        "max_id": records[-1]['id'],
+        "users": users
+    })
+
+    # Readers only ever see a complete index
+    fd, tmp_path = tempfile.mkstemp(dir=archive_dir, prefix=partition + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _add_rollups(cursor, records):
+    totals = {}
+    for record in records:
+        key = (record['user_id'], record['created_at'][:10])
+        row = totals.setdefault(key, [0, 0, 0.0, 0, 0, 0, 0, 0])
+        row[0] += 1
+        if not record['is_bot']:
+            row[1] += 1
+            if record['polarity'] is not None:
+                row[2] += record['polarity']
+                row[3] += 1
+        severity_slot = {"SAFE": 4, "ELEVATED": 5, "DISTRESSED": 6, "IMMINENT": 7}.get(record['severity'])
+        if severity_slot:
+            row[severity_slot] += 1
+
+    cursor.executemany('''
+        INSERT INTO message_rollups
+            (user_id, day, message_count, user_message_count, polarity_sum, polarity_count,
+             safe_count, elevated_count, distressed_count, imminent_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            message_count = message_count + excluded.message_count,
+            user_message_count = user_message_count + excluded.user_message_count,
+            polarity_sum = polarity_sum + excluded.polarity_sum,
+            polarity_count = polarity_count + excluded.polarity_count,
+            safe_count = safe_count + excluded.safe_count,
+            elevated_count = elevated_count + excluded.elevated_count,
+            distressed_count = distressed_count + excluded.distressed_count,
+            imminent_count = imminent_count + excluded.imminent_count
+    ''', [key + tuple(row) for key, row in totals.items()])
+
+
+def archive_old_messages(db_path='mindpeers.db', retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR):
+    """Move messages older than the retention horizon into monthly archive partitions.
+
+    Each batch is selected, appended to the archive, rolled up and deleted
+    inside one BEGIN IMMEDIATE transaction. SQLite's write lock therefore
+    serializes archivers across processes (e.g. the debug reloader's two
+    workers), and a crash before the commit can only leave a duplicate in
+    the archive, which readers drop. Returns the number of messages archived.
+    """
+    # created_at uses SQLite's CURRENT_TIMESTAMP format (UTC)
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = 0
+
+    with _write_lock:
+        # Another process may hold the write lock for a batch or two
+        conn = sqlite3.connect(db_path, timeout=60)
+        c = conn.cursor()
+        try:
+            while True:
+                c.execute('BEGIN IMMEDIATE')
+                c.execute(f'''
+                    SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages
+                    WHERE created_at < ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (cutoff, BATCH_SIZE))
+                records = [dict(zip(MESSAGE_COLUMNS, row)) for row in c.fetchall()]
+                if not records:
+                    conn.rollback()
+                    break
+
+                ids = [record['id'] for record in records]
+                placeholders = ','.join('?' * len(ids))
+                c.execute(f'''
+                    SELECT message_id, entity_text, entity_type FROM entities
+                    WHERE message_id IN ({placeholders})
+                ''', ids)
+                entities = {}
+                for message_id, entity_text, entity_type in c.fetchall():
+                    entities.setdefault(message_id, []).append({"text": entity_text, "label": entity_type})
+
+                partitions = {}
+                for record in records:
+                    record['is_bot'] = bool(record['is_bot'])
+                    record['entities'] = entities.get(record['id'], [])
+                    partitions.setdefault(record['created_at'][:7], []).append(record)
+
+                for partition, partition_records in partitions.items():
+                    _append_member(partition, partition_records, archive_dir)
+
+                c.execute(f'DELETE FROM entities WHERE message_id IN ({placeholders})', ids)
+                c.execute(f'DELETE FROM messages WHERE id IN ({placeholders})', ids)
+                if c.rowcount != len(ids):
+                    raise RuntimeError(f"Expected to archive {len(ids)} messages but deleted {c.rowcount}")
+                _add_rollups(c, records)
+                conn.commit()
+                archived += len(records)
+                time.sleep(BATCH_PAUSE_SECONDS)
+
+            # Only reclaims space if the database uses auto_vacuum=INCREMENTAL;
+            # otherwise freed pages are reused by new messages
+            if archived:
+                c.execute('PRAGMA incremental_vacuum')
+        finally:
+            conn.close()
+
+    return archived
+
+
+def _read_member(data_path, member):
+    with open(data_path, 'rb') as f:
+        f.seek(member["offset"])
+        payload = f.read(member["length"])
+    return [json.loads(line) for line in gzip.decompress(payload).decode('utf-8').splitlines()]
+
+
+def read_user_messages(user_id, limit, newest_first=False, predicate=None, before_id=None, archive_dir=ARCHIVE_DIR):
+    """Read up to limit archived messages for a user, oldest or newest first.
+
+    Messages are archived in id order, so pass the user's lowest hot message id
+    as before_id to skip rows that are still in SQLite after an interrupted run.
+    """
+    if not os.path.isdir(archive_dir):
+        return []
+
+    user = str(user_id)
+    partitions = sorted(name[:-len('.index.json')] for name in os.listdir(archive_dir)
+                        if name.endswith('.index.json'))
+    if newest_first:
+        partitions.reverse()
+
+    results = []
+    seen = set()
+    for partition in partitions:
+        data_path, index_path = _partition_paths(partition, archive_dir)
+        index = _load_index(index_path)
+        if user not in index["users"]:
+            continue
+
+        records = []
+        for member in index["members"]:
+            if user in member["users"]:
+                records.extend(r for r in _read_member(data_path, member) if str(r['user_id']) == user)
+        records.sort(key=lambda r: (r['created_at'], r['id']), reverse=newest_first)
+
+        for record in records:
+            # A batch interrupted before its delete can be archived twice
+            if record['id'] in seen or (before_id is not None and record['id'] >= before_id):
+                continue
+            if predicate and not predicate(record):
+                continue
+            seen.add(record['id'])
+            results.append(record)
+            if len(results) >= limit:
+                return results
+    return results
+
+
+class RetentionWorker(threading.Thread):
+    """Background worker that archives old messages periodically"""
+
+    def __init__(self, db_path='mindpeers.db', interval_seconds=6 * 3600):
+        super().__init__(name='retention-worker', daemon=True)
+        self.db_path = db_path
+        self.interval_seconds = interval_seconds
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                archived = archive_old_messages(self.db_path)
+                if archived:
+                    print(f"🗄 Archived {archived} messages older than {RETENTION_DAYS} days")
+            except Exception as e:
+                print(f"❌ Retention error: {e}")
+            self._stopped.wait(self.interval_seconds)
+
+
+if __name__ == '__main__':
+    print(f"🗄 Archived {archive_old_messages()} messages older than {RETENTION_DAYS} days")
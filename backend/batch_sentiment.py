@@ -0,0 +1,442 @@
+# batch_sentiment.py
+import sqlite3
+import sys
+from itertools import chain
+
+import numpy as np
+from vaderSentiment.vaderSentiment import (
+    BOOSTER_DICT, C_INCR, N_SCALAR, NEGATE, SPECIAL_CASES, SentimentIntensityAnalyzer, SentiText
+)
+
+# Vocabulary id 0 pads positions before/after a message; it has no features
+PAD = 0
+
+# Stands between texts when a batch is split in one go
+BATCH_SEPARATOR = '\x00'
+
+# Distinct tokens kept between batches before the vocabulary starts over
+MAX_VOCAB = 200000
+
+
+class _TokenCodes(dict):
+    """Raw token -> vocabulary id * 2 + ALL-CAPS flag, filled on first sight"""
+
+    def __init__(self, owner):
+        super().__init__()
+        self.owner = owner
+
+    def __missing__(self, raw):
+        word = SentiText._strip_punc_if_word(raw)
+        code = self.owner._word_id(word.lower()) * 2 + word.isupper()
+        self[raw] = code
+        return code
+
+
+class BatchSentimentAnalyzer:
+    """Score many texts at once with output identical to VADER's polarity_scores.
+
+    The lexicon, booster and negation lists are compiled into arrays indexed
+    by vocabulary id, and every VADER rule that looks at neighbouring words is
+    applied to the whole batch with shifted NumPy arrays.
+    """
+
+    def __init__(self, analyzer=None, max_vocab=MAX_VOCAB):
+        self.analyzer = analyzer or SentimentIntensityAnalyzer()
+        self.max_vocab = max_vocab
+        self.lexicon = self.analyzer.lexicon
+        self.emojis = self.analyzer.emojis
+        self._ascii_emojis = any(ch.isascii() for ch in self.emojis)
+
+        self._vocab = {'': PAD}
+        self._valence = [0.0]
+        self._in_lexicon = [False]
+        self._booster = [0.0]
+        self._is_booster = [False]
+        self._negates = [False]
+        self._arrays = None
+        self._codes = _TokenCodes(self)
+
+        # Words the rules compare against directly
+        self.NO, self.OR, self.NOR, self.BUT = map(self._word_id, ('no', 'or', 'nor', 'but'))
+        self.LEAST, self.AT, self.VERY = map(self._word_id, ('least', 'at', 'very'))
+        self.NEVER, self.SO, self.THIS = map(self._word_id, ('never', 'so', 'this'))
+        self.WITHOUT, self.DOUBT = map(self._word_id, ('without', 'doubt'))
+        self.KIND, self.OF = map(self._word_id, ('kind', 'of'))
+
+        # Multi-word phrases as tuples of word ids
+        self._special_cases = [
+            (tuple(map(self._word_id, phrase.split())), value)
+            for phrase, value in SPECIAL_CASES.items()
+        ]
+        self._booster_phrases = [
+            (tuple(map(self._word_id, phrase.split())), value)
+            for phrase, value in BOOSTER_DICT.items() if ' ' in phrase
+        ]
+        self._phrase_words = np.array(sorted(
+            {word_id for phrase, _ in self._special_cases + self._booster_phrases for word_id in phrase}
+        ))
+
+        # Rule and phrase words keep their ids when the vocabulary is reset
+        self._base_vocab = dict(self._vocab)
+
+    def reset_vocabulary(self):
+        """Forget every word seen in earlier batches"""
+        size = len(self._base_vocab)
+        self._vocab = dict(self._base_vocab)
+        for column in (self._valence, self._in_lexicon, self._booster, self._is_booster, self._negates):
+            del column[size:]
+        self._arrays = None
+        self._codes = _TokenCodes(self)
+
+    def _word_id(self, word):
+        word_id = self._vocab.get(word)
+        if word_id is None:
+            word_id = len(self._valence)
+            self._vocab[word] = word_id
+            self._valence.append(self.lexicon.get(word, 0.0))
+            self._in_lexicon.append(word in self.lexicon)
+            self._booster.append(BOOSTER_DICT.get(word, 0.0))
+            self._is_booster.append(word in BOOSTER_DICT)
+            self._negates.append(word in NEGATE or "n't" in word)
+        return word_id
+
+    def _feature_arrays(self):
+        # Only words added since the last call need converting
+        built = 0 if self._arrays is None else len(self._arrays[0])
+        if built != len(self._valence):
+            new = (
+                np.array(self._valence[built:], dtype=np.float64),
+                np.array(self._in_lexicon[built:], dtype=bool),
+                np.array(self._booster[built:], dtype=np.float64),
+                np.array(self._is_booster[built:], dtype=bool),
+                np.array(self._negates[built:], dtype=bool),
+            )
+            self._arrays = new if self._arrays is None else tuple(map(np.concatenate, zip(self._arrays, new)))
+        return self._arrays
+
+    def _replace_emojis(self, text):
+        # Same conversion as polarity_scores; most messages have no emoji at all
+        if text.isascii() and not self._ascii_emojis:
+            return text.strip()
+        text_no_emoji = ""
+        prev_space = True
+        for chr in text:
+            if chr in self.emojis:
+                description = self.emojis[chr]
+                if not prev_space:
+                    text_no_emoji += ' '
+                text_no_emoji += description
+                prev_space = False
+            else:
+                text_no_emoji += chr
+                prev_space = chr == ' '
+        return text_no_emoji.strip()
+
+    def polarity_scores_batch(self, texts):
+        """Return a polarity_scores dict for every text, in order"""
+        scores = self.score_arrays(texts)
+        return [
+            {"neg": n, "neu": u, "pos": p, "compound": c}
+            for n, u, p, c in zip(*(scores[key].tolist() for key in ("neg", "neu", "pos", "compound")))
+        ]
+
+    def score_arrays(self, texts):
+        """Return neg/neu/pos/compound as arrays aligned with texts (no per-text dicts)"""
+        texts = [self._replace_emojis(text) for text in texts]
+        if len(self._codes) > self.max_vocab:
+            self.reset_vocabulary()
+        n_docs = len(texts)
+        if not n_docs:
+            return {key: np.zeros(0) for key in ("neg", "neu", "pos", "compound")}
+
+        codes, lengths = self._tokenize(texts)
+        n_tok = len(codes)
+        valence, in_lexicon, booster, is_booster, negates = self._feature_arrays()
+        ids = codes >> 1
+        upper = (codes & 1).astype(bool)
+
+        doc = np.repeat(np.arange(n_docs), lengths)
+        starts = np.cumsum(lengths) - lengths
+        pos = np.arange(n_tok) - starts[doc]
+
+        # Some but not all words in the message are ALL CAPS
+        n_upper = np.bincount(doc, weights=upper, minlength=n_docs)
+        doc_cap_diff = (n_upper > 0) & (n_upper < lengths)
+
+        # Only lexicon words get a valence; boosters score zero even if they're in the lexicon
+        idx = np.flatnonzero(in_lexicon[ids] & ~is_booster[ids])
+        w_pos, w_len = pos[idx], lengths[doc[idx]]
+        w_ids = ids[idx]
+
+        def neighbour(arr, k, fill):
+            # Value k words after (k > 0) or before (k < 0) each lexicon word, within its own message
+            inside = (w_pos + k >= 0) & (w_pos + k < w_len)
+            return np.where(inside, arr[np.clip(idx + k, 0, max(n_tok - 1, 0))], fill)
+
+        p1, p2, p3 = (neighbour(ids, -k, PAD) for k in (1, 2, 3))
+        n1, n2 = (neighbour(ids, k, PAD) for k in (1, 2))
+        u1, u2, u3 = (neighbour(upper, -k, False) for k in (1, 2, 3))
+        cap_diff = doc_cap_diff[doc[idx]]
+
+        # "kind of" scores zero
+        kind_of = (w_ids == self.KIND) & (n1 == self.OF)
+
+        base = valence[w_ids]
+        v = np.where((w_ids == self.NO) & in_lexicon[n1], 0.0, base)
+        negated_by_no = (p1 == self.NO) | (p2 == self.NO) | ((p3 == self.NO) & ((p1 == self.OR) | (p1 == self.NOR)))
+        v = np.where(negated_by_no, base * N_SCALAR, v)
+        v = np.where(upper[idx] & cap_diff, np.where(v > 0, v + C_INCR, v - C_INCR), v)
+
+        so_this_1 = (p1 == self.SO) | (p1 == self.THIS)
+        so_this_2 = (p2 == self.SO) | (p2 == self.THIS)
+
+        for start_i, prev, prev_upper in ((0, p1, u1), (1, p2, u2), (2, p3, u3)):
+            applies = (w_pos > start_i) & ~in_lexicon[prev]
+
+            # Booster/dampener before the word, signed to match it
+            s = np.where(v < 0, booster[prev] * -1, booster[prev])
+            s = np.where(prev_upper & cap_diff, np.where(v > 0, s + C_INCR, s - C_INCR), s)
+            s = np.where(is_booster[prev], s, 0.0)
+            if start_i == 1:
+                s = np.where(s != 0, s * 0.95, s)
+            elif start_i == 2:
+                s = np.where(s != 0, s * 0.9, s)
+            checked = v + s
+
+            if start_i == 0:
+                checked = np.where(negates[p1], checked * N_SCALAR, checked)
+            elif start_i == 1:
+                checked = np.where(
+                    (p2 == self.NEVER) & so_this_1, checked * 1.25,
+                    np.where((p2 == self.WITHOUT) & (p1 == self.DOUBT), checked,
+                             np.where(negates[p2], checked * N_SCALAR, checked)))
+            else:
+                checked = np.where(
+                    ((p3 == self.NEVER) & so_this_2) | so_this_1, checked * 1.25,
+                    np.where((p3 == self.WITHOUT) & ((p2 == self.DOUBT) | (p1 == self.DOUBT)), checked,
+                             np.where(negates[p3], checked * N_SCALAR, checked)))
+                checked = self._special_idioms(checked, w_ids, p1, p2, p3, n1, n2)
+
+            v = np.where(applies, checked, v)
+
+        # "least" negates the next word unless it's "at least" or "very least"
+        least = (p1 == self.LEAST) & ~in_lexicon[p1] & ((w_pos == 1) | ((p2 != self.AT) & (p2 != self.VERY)))
+        v = np.where(least, v * N_SCALAR, v)
+
+        sentiments = np.zeros(n_tok)
+        sentiments[idx] = np.where(kind_of, 0.0, v)
+
+        self._but_check(sentiments, ids, doc, pos, starts, lengths)
+
+        return self._score_valence(texts, sentiments, doc, pos, lengths)
+
+    def _tokenize(self, texts):
+        """Split every text into VADER words and return (codes, words per text)"""
+        # One split over the joined batch is much cheaper than one per text
+        joined = f" {BATCH_SEPARATOR} ".join(texts)
+        if joined.count(BATCH_SEPARATOR) == len(texts) - 1:
+            codes = np.fromiter(map(self._codes.__getitem__, joined.split()), dtype=np.int64)
+            separator = self._codes[BATCH_SEPARATOR]
+            breaks = np.flatnonzero(codes == separator)
+            lengths = np.diff(np.concatenate(([-1], breaks, [len(codes)]))) - 1
+            return codes[codes != separator], lengths
+
+        # Some text contains the separator itself; fall back to splitting each text
+        split_texts = [text.split() for text in texts]
+        lengths = np.fromiter(map(len, split_texts), dtype=np.int64, count=len(texts))
+        codes = np.fromiter(
+            map(self._codes.__getitem__, chain.from_iterable(split_texts)), dtype=np.int64, count=int(lengths.sum())
+        )
+        return codes, lengths
+
+    def _but_check(self, sentiments, ids, doc, pos, starts, lengths):
+        """Halve sentiment before the first "but" and boost it by half after"""
+        but_tokens = np.flatnonzero(ids == self.BUT)
+        if not len(but_tokens):
+            return
+        # Position of the first "but" in each message that has one
+        but_docs, first = np.unique(doc[but_tokens], return_index=True)
+        bi = np.full(len(lengths), -1)
+        bi[but_docs] = pos[but_tokens[first]]
+
+        in_scope = np.flatnonzero((bi[doc] >= 0) & (sentiments != 0))
+        original = sentiments[in_scope]
+        token_bi = bi[doc[in_scope]]
+        scaled = np.where(pos[in_scope] < token_bi, original * 0.5,
+                          np.where(pos[in_scope] > token_bi, original * 1.5, original))
+
+        # VADER finds each value with list.index, so a value repeated in the message
+        # (before or after scaling) hits the wrong position; replay those exactly
+        values = np.concatenate([original, scaled[scaled != original]])
+        owners = np.concatenate([doc[in_scope], doc[in_scope][scaled != original]])
+        order = np.lexsort((values, owners))
+        repeated = (owners[order][1:] == owners[order][:-1]) & (values[order][1:] == values[order][:-1])
+        quirky = np.unique(owners[order][1:][repeated])
+
+        replay = [(starts[d], starts[d] + lengths[d], int(bi[d])) for d in quirky]
+        unscaled = [sentiments[start:end].tolist() for start, end, _ in replay]
+        sentiments[in_scope] = scaled
+        for (start, end, doc_bi), values in zip(replay, unscaled):
+            sentiments[start:end] = _but_check(doc_bi, values)
+
+    def _special_idioms(self, v, ids, p1, p2, p3, n1, n2):
+        # Only words next to a phrase word can match anything
+        idx = np.flatnonzero(np.isin(ids, self._phrase_words) | np.isin(p1, self._phrase_words)
+                             | np.isin(p2, self._phrase_words))
+        if not len(idx):
+            return v
+        ids, p1, p2, p3, n1, n2 = (column[idx] for column in (ids, p1, p2, p3, n1, n2))
+        checked = v[idx]
+
+        def matches(columns, phrase):
+            mask = columns[0] == phrase[0]
+            for column, word_id in zip(columns[1:], phrase[1:]):
+                mask &= column == word_id
+            return mask
+
+        # The first matching phrase before the word wins, so apply them last to first
+        sequences = [(p1, ids), (p2, p1, ids), (p2, p1), (p3, p2, p1), (p3, p2)]
+        for columns in reversed(sequences):
+            for phrase, value in self._special_cases:
+                if len(phrase) == len(columns):
+                    checked = np.where(matches(columns, phrase), float(value), checked)
+
+        # Phrases starting at the word override those
+        for columns in ((ids, n1), (ids, n1, n2)):
+            for phrase, value in self._special_cases:
+                if len(phrase) == len(columns):
+                    checked = np.where(matches(columns, phrase), float(value), checked)
+
+        # Booster bi-grams such as "sort of" or "kind of"
+        for columns in ((p3, p2, p1), (p3, p2), (p2, p1)):
+            for phrase, value in self._booster_phrases:
+                if len(phrase) == len(columns):
+                    checked = np.where(matches(columns, phrase), checked + value, checked)
+
+        v = v.copy()
+        v[idx] = checked
+        return v
+
+    def _score_valence(self, texts, sentiments, doc, pos, lengths):
+        n_docs = len(texts)
+
+        # Accumulate word by word so sums round exactly like Python's sum()
+        sum_s = np.zeros(n_docs)
+        pos_sum = np.zeros(n_docs)
+        neg_sum = np.zeros(n_docs)
+        order = np.argsort(pos, kind='stable')
+        breaks = np.searchsorted(pos[order], np.arange(1, int(lengths.max(initial=0)) + 1))
+        for step in np.split(order, breaks):
+            if not len(step):
+                continue
+            d, s = doc[step], sentiments[step]
+            sum_s[d] += s
+            pos_sum[d] = np.where(s > 0, pos_sum[d] + (s + 1), pos_sum[d])
+            neg_sum[d] = np.where(s < 0, neg_sum[d] + (s - 1), neg_sum[d])
+        neu_count = np.bincount(doc, weights=(sentiments == 0), minlength=n_docs)
+
+        # Emphasis from exclamation points (up to 4) and question marks (2 or more)
+        ep = np.array([min(text.count("!"), 4) for text in texts], dtype=np.float64) * 0.292
+        qm_count = np.array([text.count("?") for text in texts], dtype=np.float64)
+        qm = np.where(qm_count > 1, np.where(qm_count <= 3, qm_count * 0.18, 0.96), 0.0)
+        amplifier = ep + qm
+
+        sum_s = np.where(sum_s > 0, sum_s + amplifier, np.where(sum_s < 0, sum_s - amplifier, sum_s))
+        compound = np.clip(sum_s / np.sqrt((sum_s * sum_s) + 15), -1.0, 1.0)
+
+        abs_neg = np.abs(neg_sum)
+        more_positive, more_negative = pos_sum > abs_neg, pos_sum < abs_neg
+        pos_sum = np.where(more_positive, pos_sum + amplifier, pos_sum)
+        neg_sum = np.where(more_negative, neg_sum - amplifier, neg_sum)
+        has_words = lengths > 0
+        total = np.where(has_words, pos_sum + np.abs(neg_sum) + neu_count, 1.0)
+
+        pos = np.where(has_words, np.abs(pos_sum / total), 0.0)
+        neg = np.where(has_words, np.abs(neg_sum / total), 0.0)
+        neu = np.where(has_words, np.abs(neu_count / total), 0.0)
+        compound = np.where(has_words, compound, 0.0)
+
+        return {
+            "neg": _round(neg, 3),
+            "neu": _round(neu, 3),
+            "pos": _round(pos, 3),
+            "compound": _round(compound, 4)
+        }
+
+
+def _round(values, ndigits):
+    """Round like Python's round(), which np.round doesn't match near halves"""
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    rounded = np.rint(scaled) / scale
+    # Away from a half both agree; close to one, defer to round() itself
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        rounded[i] = round(float(values[i]), ndigits)
+    return rounded
+
+
+def _but_check(bi, sentiments):
+    """VADER's 'but' rule, including its use of list.index on duplicate values"""
+    for sentiment in sentiments:
+        si = sentiments.index(sentiment)
+        if si < bi:
+            sentiments.pop(si)
+            sentiments.insert(si, sentiment * 0.5)
+        elif si > bi:
+            sentiments.pop(si)
+            sentiments.insert(si, sentiment * 1.5)
+    return sentiments
+
+
+def verify_against_reference(texts, batch_analyzer=None):
+    """Return the texts whose batch scores differ from SentimentIntensityAnalyzer's"""
+    batch_analyzer = batch_analyzer or BatchSentimentAnalyzer()
+    scores = batch_analyzer.polarity_scores_batch(texts)
+    return [
+        text for text, score in zip(texts, scores)
+        if score != batch_analyzer.analyzer.polarity_scores(text)
+    ]
+
+
+def backfill_polarity(db_path='mindpeers.db', batch_size=10000):
+    """Score user messages that were stored without a polarity"""
+    batch_analyzer = BatchSentimentAnalyzer()
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    updated = 0
+    last_id = 0
+    try:
+        while True:
+            c.execute('''
+                SELECT id, message_text FROM messages
+                WHERE id > ? AND is_bot = FALSE AND polarity IS NULL
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, batch_size))
+            rows = c.fetchall()
+            if not rows:
+                break
+            compound = batch_analyzer.score_arrays([text for _, text in rows])['compound']
+            c.executemany(
+                'UPDATE messages SET polarity = ? WHERE id = ?',
+                zip(compound.tolist(), [message_id for message_id, _ in rows])
+            )
+            conn.commit()
+            updated += len(rows)
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+    return updated
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--verify':
+        conn = sqlite3.connect('mindpeers.db')
+        texts = [row[0] for row in conn.execute('SELECT message_text FROM messages')]
+        conn.close()
+        mismatches = verify_against_reference(texts)
+        print(f"🔍 {len(texts) - len(mismatches)}/{len(texts)} messages match VADER exactly")
+        for text in mismatches[:10]:
+            print(f"❌ {text}")
+    else:
+        print(f"✅ Backfilled polarity for {backfill_polarity()} messages")
@@ -0,0 +1,252 @@
+# escalation.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# One alert per user inside this window, however many crisis messages they send
+DEDUP_WINDOW_SECONDS = int(os.environ.get('ESCALATION_DEDUP_WINDOW', 900))
+MAX_ATTEMPTS = int(os.environ.get('ESCALATION_MAX_ATTEMPTS', 5))
+# Undelivered alerts older than this are marked stale instead of being sent late
+STALE_AFTER_SECONDS = int(os.environ.get('ESCALATION_STALE_AFTER', 6 * 3600))
+BASE_BACKOFF_SECONDS = 2.0
+# Rows stuck in 'sending' longer than this (e.g. after a crash) are retried
+LEASE_SECONDS = 60
+
+
+def init_escalation_table(db_path='mindpeers.db'):
+    """Create the escalation outbox table"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS escalations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message_id INTEGER,
+            severity TEXT NOT NULL,
+            emergency_phone TEXT,
+            dedup_key TEXT UNIQUE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at REAL NOT NULL,
+            claimed_at REAL,
+            sent_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (message_id) REFERENCES messages (id)
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_escalations_due
+        ON escalations (status, next_attempt_at)
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_escalations_user_created
+        ON escalations (user_id, created_at)
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def enqueue_escalation(cursor, user_id, message_id, severity, emergency_phone):
+    """Record an escalation in the outbox using the caller's transaction.
+
+    Returns the new escalation id, or None if an alert for this user is
+    still undelivered or was sent within the last DEDUP_WINDOW_SECONDS. Call
+    it after the transaction has written (e.g. the message insert) so
+    SQLite's write lock keeps the check and insert atomic across connections.
+    """
+    cursor.execute('''
+        SELECT 1 FROM escalations
+        WHERE user_id = ?
+          AND (status IN ('pending', 'sending')
+               OR (status = 'sent' AND created_at > datetime('now', ?)))
+        LIMIT 1
+    ''', (user_id, f"-{DEDUP_WINDOW_SECONDS} seconds"))
+    if cursor.fetchone():
+        return None
+
+    # Without an emergency contact there is nobody to alert, but the row is kept for review
+    status = 'pending' if emergency_phone else 'no_contact'
+
+    cursor.execute('''
+        INSERT INTO escalations
+            (user_id, message_id, severity, emergency_phone, dedup_key, status, next_attempt_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, message_id, severity, emergency_phone, f"message:{message_id}", status, time.time()))
+
+    return cursor.lastrowid
+
+
+class FileNotifier:
+    """Append alerts as JSON lines to a local file (testing stub)"""
+
+    def __init__(self, path='escalations.log'):
+        self.path = path
+
+    def send(self, alert):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(alert) + '\n')
+
+
+class HttpNotifier:
+    """POST alerts as JSON to a webhook"""
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert):
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps(alert).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        # urlopen raises HTTPError for non-2xx responses
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            response.read()
+
+
+def notifier_from_env():
+    """Build a notifier from ESCALATION_NOTIFIER ('http(s)://...' or 'file:<path>').
+
+    Returns None when it is unset, so alerts stay pending until a real
+    notifier is configured rather than being reported as sent.
+    """
+    target = os.environ.get('ESCALATION_NOTIFIER')
+    if not target:
+        print("⚠️ ESCALATION_NOTIFIER is not set, crisis alerts will stay pending")
+        return None
+    if target.startswith(('http://', 'https://')):
+        return HttpNotifier(target)
+    if target.startswith('file:'):
+        return FileNotifier(target[len('file:'):])
+    raise ValueError(f"Unsupported ESCALATION_NOTIFIER: {target}")
+
+
+class EscalationDispatcher(threading.Thread):
+    """Background worker that delivers pending escalations with retries"""
+
+    def __init__(self, notifier, db_path='mindpeers.db', poll_interval=5.0):
+        super().__init__(name='escalation-dispatcher', daemon=True)
+        self.notifier = notifier
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def wake(self):
+        """Deliver newly enqueued escalations without waiting for the next poll"""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.dispatch_pending()
+            except Exception as e:
+                print(f"❌ Escalation dispatch error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def dispatch_pending(self):
+        """Send every due escalation once; returns the number delivered"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        delivered = 0
+        try:
+            # An alert hours late is no use to anyone, and would arrive in a burst
+            # once a notifier is configured; leave it for review instead
+            c.execute('''
+                UPDATE escalations SET status = 'stale', claimed_at = NULL
+                WHERE status IN ('pending', 'sending') AND created_at <= datetime('now', ?)
+            ''', (f"-{STALE_AFTER_SECONDS} seconds",))
+            if c.rowcount:
+                print(f"⚠️ Marked {c.rowcount} undelivered escalations as stale")
+            conn.commit()
+
+            if self.notifier is None:
+                return 0
+
+            now = time.time()
+            c.execute('''
+                SELECT id, user_id, message_id, severity, emergency_phone, attempts, created_at
+                FROM escalations
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND claimed_at <= ?)
+                ORDER BY id
+            ''', (now, now - LEASE_SECONDS))
+            rows = c.fetchall()
+
+            for escalation_id, user_id, message_id, severity, phone, attempts, created_at in rows:
+                # Claim the row so a second worker (e.g. the debug reloader) can't send it too
+                c.execute('''
+                    UPDATE escalations SET status = 'sending', claimed_at = ?
+                    WHERE id = ? AND (status = 'pending' OR (status = 'sending' AND claimed_at <= ?))
+                ''', (time.time(), escalation_id, now - LEASE_SECONDS))
+                conn.commit()
+                if not c.rowcount:
+                    continue
+
+                alert = {
+                    "escalation_id": escalation_id,
+                    "user_id": user_id,
+                    "message_id": message_id,
+                    "severity": severity,
+                    "emergency_phone": phone,
+                    "created_at": created_at
+                }
+
+                try:
+                    self.notifier.send(alert)
+                except Exception as e:
+                    attempts += 1
+                    if attempts >= MAX_ATTEMPTS:
+                        status, next_attempt_at = 'failed', time.time()
+                        print(f"❌ Escalation {escalation_id} failed after {attempts} attempts: {e}")
+                    else:
+                        status = 'pending'
+                        next_attempt_at = time.time() + BASE_BACKOFF_SECONDS * (2 ** (attempts - 1))
+                        print(f"⚠️ Escalation {escalation_id} attempt {attempts} failed: {e}")
+                    c.execute('''
+                        UPDATE escalations
+                        SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, claimed_at = NULL
+                        WHERE id = ?
+                    ''', (status, attempts, str(e), next_attempt_at, escalation_id))
+                else:
+                    c.execute('''
+                        UPDATE escalations
+                        SET status = 'sent', attempts = ?, last_error = NULL, sent_at = ?, claimed_at = NULL
+                        WHERE id = ?
+                    ''', (attempts + 1, datetime.now(), escalation_id))
+                    delivered += 1
+                    print(f"🚨 Escalation {escalation_id} sent for user ID: {user_id}")
+                conn.commit()
+        finally:
+            conn.close()
+
+        return delivered
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        print(f"📟 Stub received escalation: {body.decode('utf-8')}")
+        self.send_response(200)
+        self.end_headers()
+
+
+if __name__ == '__main__':
+    # Local webhook stub: ESCALATION_NOTIFIER=http://localhost:8099 python app.py
+    port = int(os.environ.get('ESCALATION_STUB_PORT', 8099))
+    print(f"📟 Escalation stub listening on http://localhost:{port}")
+    HTTPServer(('0.0.0.0', port), _StubHandler).serve_forever()
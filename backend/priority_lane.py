@@ -0,0 +1,49 @@
+# priority_lane.py
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+CRISIS = 0
+NORMAL = 1
+
+
+class PriorityLane:
+    """Run slow analysis jobs on one worker thread, crisis jobs first"""
+
+    def __init__(self, name="analysis-lane"):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, priority=NORMAL):
+        """Queue func(*args) and return a Future for its result"""
+        future = Future()
+        with self._cond:
+            # The sequence number keeps jobs of the same priority in FIFO order
+            heapq.heappush(self._heap, (priority, next(self._seq), future, func, args))
+            self._cond.notify()
+        return future
+
+    def depth(self):
+        """Number of jobs waiting to run"""
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, future, func, args = heapq.heappop(self._heap)
+
+            # Skip jobs whose caller gave up waiting
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
@@ -0,0 +1,134 @@
+# search.py
+import sqlite3
+
+MAX_RESULTS = 100
+
+
+def init_search_index(db_path='mindpeers.db'):
+    """Create the FTS5 index over message_text and the triggers that keep it in sync.
+
+    Returns False if this SQLite build has no FTS5 support.
+    """
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    try:
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+        exists = c.fetchone() is not None
+
+        # External content table: the text itself stays in messages
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                message_text,
+                content='messages',
+                content_rowid='id',
+                tokenize='porter unicode61'
+            )
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message_text)
+                VALUES ('delete', old.id, old.message_text);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message_text)
+                VALUES ('delete', old.id, old.message_text);
+                INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+            END
+        ''')
+
+        # Index messages stored before the index existed
+        if not exists:
+            c.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            print("✅ Built full-text search index for messages")
+
+        conn.commit()
+        return True
+    except sqlite3.OperationalError as e:
+        print(f"❌ Full-text search unavailable: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query that matches all terms.
+
+    Each term is quoted so punctuation can't be read as FTS syntax; a
+    trailing * still does prefix matching.
+    """
+    terms = []
+    for term in query.split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_messages(query, severity=None, concern_label=None, user_id=None, date_from=None,
+                    date_to=None, include_bot=False, limit=20, offset=0, db_path='mindpeers.db'):
+    """Ranked full-text search over messages with optional filters.
+
+    severity and concern_label may be lists; date_from and date_to are
+    inclusive 'YYYY-MM-DD' dates.
+    """
+    match = build_match_query(query or '')
+    if not match:
+        return []
+
+    conditions = ['messages_fts MATCH ?']
+    params = [match]
+
+    if not include_bot:
+        conditions.append('m.is_bot = FALSE')
+    for column, values in (('m.severity', severity), ('m.concern_label', concern_label)):
+        if values:
+            values = [values] if isinstance(values, str) else list(values)
+            conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    if user_id is not None:
+        conditions.append('m.user_id = ?')
+        params.append(user_id)
+    if date_from:
+        conditions.append('m.created_at >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append("m.created_at < date(?, '+1 day')")
+        params.append(date_to)
+
+    params.extend([max(1, min(limit, MAX_RESULTS)), max(0, offset)])
+
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT m.id, m.user_id, m.severity, m.concern_label, m.polarity, m.created_at,
+                   snippet(messages_fts, 0, '[', ']', '...', 12),
+                   bm25(messages_fts) AS rank
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        ''', params)
+        rows = c.fetchall()
+    finally:
+        conn.close()
+
+    return [{
+        "message_id": message_id,
+        "user_id": row_user_id,
+        "severity": row_severity,
+        "concern_label": row_concern,
+        "polarity": polarity,
+        "created_at": created_at,
+        "snippet": snippet,
+        "rank": round(rank, 4)
+    } for message_id, row_user_id, row_severity, row_concern, polarity, created_at, snippet, rank in rows]
@@ -0,0 +1,78 @@
+# test_admission.py
+import time
+
+import pytest
+
+import admission
+from admission import AdmissionController, Rejected
+
+
+class Backlog:
+    """Stand-in for the analysis lane's depth()"""
+
+    def __init__(self, depth=0):
+        self.depth = depth
+
+    def __call__(self):
+        return self.depth
+
+
+def test_user_bucket_rejects_past_burst_with_retry_after():
+    controller = AdmissionController(Backlog(), burst=2, rate_per_minute=6)
+    for _ in range(2):
+        controller.release(controller.admit(1))
+
+    with pytest.raises(Rejected) as rejected:
+        controller.admit(1)
+    assert rejected.value.retry_after == 10
+    # Other users and crisis messages have their own allowance
+    controller.release(controller.admit(2))
+    controller.release(controller.admit(1, crisis=True))
+
+
+def test_crisis_messages_get_extra_in_flight_room():
+    controller = AdmissionController(Backlog(), max_in_flight=1, crisis_extra_in_flight=1)
+    controller.admit(1)
+    with pytest.raises(Rejected):
+        controller.admit(2)
+    controller.admit(3, crisis=True)
+    with pytest.raises(Rejected):
+        controller.admit(4, crisis=True)
+
+
+def test_degraded_mode_switches_with_hysteresis():
+    backlog = Backlog()
+    controller = AdmissionController(backlog, degrade_depth=8, recover_depth=2)
+    assert not controller.degraded()
+
+    backlog.depth = 8
+    assert controller.degraded()
+    backlog.depth = 5
+    assert controller.degraded()
+    backlog.depth = 2
+    assert not controller.degraded()
+
+
+def test_slow_classifier_degrades_before_depth_limit():
+    backlog = Backlog(3)
+    controller = AdmissionController(backlog, degrade_depth=8, slo_seconds=3.0)
+    controller.observe('classify', 1.5)
+    assert controller.degraded()
+
+
+def test_snapshot_reports_recovery_without_new_messages():
+    backlog = Backlog(10)
+    controller = AdmissionController(backlog)
+    assert controller.degraded()
+
+    backlog.depth = 0
+    snapshot = controller.snapshot()
+    assert snapshot['queue_depth'] == 0
+    assert snapshot['degraded'] is False
+
+
+def test_classify_budget_shrinks_to_zero():
+    controller = AdmissionController(Backlog(), slo_seconds=3.0)
+    now = time.monotonic()
+    assert controller.classify_budget(now) == pytest.approx(3.0 * admission.CLASSIFY_SLO_SHARE, abs=0.05)
+    assert controller.classify_budget(now - 10) == 0.0
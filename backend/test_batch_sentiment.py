@@ -0,0 +1,122 @@
+# test_batch_sentiment.py
+import random
+
+import pytest
+from vaderSentiment.vaderSentiment import BOOSTER_DICT, NEGATE, SPECIAL_CASES
+
+from batch_sentiment import BatchSentimentAnalyzer
+
+TRICKY_TEXTS = [
+    # "but" with values repeated before and after scaling; VADER's list.index
+    # lands on the wrong word when one valence is half or 1.5x another
+    "I feel hopeless and anxious but alone",
+    "hurt and worried but worried",
+    "I feel helpless but I am anxious and hopeless",
+    "good good but good",
+    "good but good good",
+    "bad but bad bad and bad",
+    "nice movie but nice actors but nice music",
+    "I love it but I love it more now",
+    "happy happy but sad sad",
+    "but",
+    "good but",
+    # "kind of"
+    "it was kind of good",
+    "I kind of hate this",
+    "kind of",
+    "kind",
+    # "least"
+    "at least it was good",
+    "at the very least good",
+    "the least good thing",
+    "least good",
+    # ALL CAPS, alone and mixed with lowercase
+    "I am SO HAPPY today",
+    "THIS IS GREAT",
+    "I LOVE it but HATE the ending",
+    "GOOD",
+    # Exclamation and question emphasis
+    "good!",
+    "good!!!!",
+    "good!!!!!!!!",
+    "bad??",
+    "bad???",
+    "bad?????",
+    "good?!?!",
+    "?!",
+    # Emoji
+    "I feel 😢",
+    "love it ❤️😊",
+    "😂😂",
+    "great job👍",
+    # Negation and idioms
+    "not good",
+    "never so good",
+    "without doubt good",
+    "isn't bad at all",
+    "that was the bomb",
+    "the shit",
+    "he can't cut the mustard",
+    "living hand to mouth",
+    "sort of good",
+    "no good",
+    "no problem or worry",
+    # The batch separator inside a text
+    "good\x00bad",
+    "\x00",
+    # Whitespace only
+    "",
+    "   ",
+]
+
+
+@pytest.fixture(scope="module")
+def batch_analyzer():
+    return BatchSentimentAnalyzer()
+
+
+def reference(batch_analyzer, texts):
+    return [batch_analyzer.analyzer.polarity_scores(text) for text in texts]
+
+
+def test_tricky_texts_match_vader(batch_analyzer):
+    assert batch_analyzer.polarity_scores_batch(TRICKY_TEXTS) == reference(batch_analyzer, TRICKY_TEXTS)
+
+
+def test_each_text_alone_matches_vader(batch_analyzer):
+    for text in TRICKY_TEXTS:
+        assert batch_analyzer.polarity_scores_batch([text]) == reference(batch_analyzer, [text]), text
+
+
+def test_separator_free_batch_matches_vader(batch_analyzer):
+    # Without a \x00 in any text the batch is split in one go
+    texts = [text for text in TRICKY_TEXTS if '\x00' not in text]
+    assert batch_analyzer.polarity_scores_batch(texts) == reference(batch_analyzer, texts)
+
+
+def test_empty_batch(batch_analyzer):
+    assert batch_analyzer.polarity_scores_batch([]) == []
+
+
+def test_random_texts_match_vader(batch_analyzer):
+    rng = random.Random(42)
+    words = (sorted(batch_analyzer.lexicon)[::40] + list(BOOSTER_DICT) + list(NEGATE) + list(SPECIAL_CASES)
+             + ['but', 'BUT', 'kind', 'of', 'at', 'least', 'very', 'so', 'this', 'never', 'without', 'doubt',
+                'no', 'or', 'nor', 'GOOD', 'Bad', 'LOVE', 'happy!', 'sad?', '😢', '😊', 'work', 'exam',
+                'anxious', 'alone', 'lonely', 'hopeless', 'worried', 'hurt', 'ok', 'nice', 'happy'])
+    texts = []
+    for _ in range(3000):
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(0, 14)))
+        text += rng.choice(['', '', '!', '!!!', '?', '??', '???!', '!!!!!!'])
+        texts.append(text)
+    assert batch_analyzer.polarity_scores_batch(texts) == reference(batch_analyzer, texts)
+
+
+def test_vocabulary_reset_keeps_results_exact():
+    batch_analyzer = BatchSentimentAnalyzer(max_vocab=5)
+    first = ["good good but good", "I am SO HAPPY today", "not good"]
+    second = ["never so good", "kind of bad but at least honest", "THIS IS GREAT"]
+    assert batch_analyzer.polarity_scores_batch(first) == reference(batch_analyzer, first)
+    assert batch_analyzer.polarity_scores_batch(second) == reference(batch_analyzer, second)
+    # The second batch started from the base vocabulary again
+    assert len(batch_analyzer._codes) <= len(set(' '.join(second).split())) + 1
@@ -0,0 +1,213 @@
+# test_escalation.py
+import json
+import sqlite3
+import time
+
+import pytest
+
+import escalation
+from escalation import (
+    EscalationDispatcher, FileNotifier, HttpNotifier, enqueue_escalation, init_escalation_table, notifier_from_env
+)
+
+
+class FlakyNotifier:
+    """Fails the first `failures` sends, then records alerts"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.sent = []
+
+    def send(self, alert):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("webhook down")
+        self.sent.append(alert)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'escalations.db')
+    init_escalation_table(path)
+    return path
+
+
+def enqueue(db_path, user_id, message_id, phone='+911234567890'):
+    conn = sqlite3.connect(db_path)
+    try:
+        escalation_id = enqueue_escalation(conn.cursor(), user_id, message_id, 'IMMINENT', phone)
+        conn.commit()
+        return escalation_id
+    finally:
+        conn.close()
+
+
+def row(db_path, escalation_id):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return dict(conn.execute('SELECT * FROM escalations WHERE id = ?', (escalation_id,)).fetchone())
+    finally:
+        conn.close()
+
+
+def update(db_path, sql, *params):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_dedup_blocks_second_alert_for_same_user(db_path):
+    first = enqueue(db_path, 1, 10)
+    assert first is not None
+    assert enqueue(db_path, 1, 11) is None
+    assert enqueue(db_path, 2, 12) is not None
+
+
+def test_dedup_window_slides_from_last_sent_alert(db_path):
+    first = enqueue(db_path, 1, 10)
+    update(db_path, "UPDATE escalations SET status = 'sent' WHERE id = ?", first)
+    assert enqueue(db_path, 1, 11) is None
+
+    # Just past the window, measured from the alert itself rather than a fixed boundary
+    update(db_path, "UPDATE escalations SET created_at = datetime('now', ?) WHERE id = ?",
+           f"-{escalation.DEDUP_WINDOW_SECONDS + 1} seconds", first)
+    assert enqueue(db_path, 1, 12) is not None
+
+
+def test_undelivered_alert_blocks_new_ones_past_window(db_path):
+    first = enqueue(db_path, 1, 10)
+    update(db_path, "UPDATE escalations SET created_at = datetime('now', ?) WHERE id = ?",
+           f"-{escalation.DEDUP_WINDOW_SECONDS * 2} seconds", first)
+    assert enqueue(db_path, 1, 11) is None
+
+    update(db_path, "UPDATE escalations SET status = 'failed' WHERE id = ?", first)
+    assert enqueue(db_path, 1, 12) is not None
+
+
+def test_no_contact_is_kept_but_not_sent(db_path, tmp_path):
+    escalation_id = enqueue(db_path, 1, 10, phone=None)
+    notifier = FileNotifier(str(tmp_path / 'alerts.log'))
+    assert EscalationDispatcher(notifier, db_path).dispatch_pending() == 0
+    assert row(db_path, escalation_id)['status'] == 'no_contact'
+
+
+def test_file_notifier_delivers_and_marks_sent(db_path, tmp_path):
+    escalation_id = enqueue(db_path, 1, 10)
+    log_path = tmp_path / 'alerts.log'
+    assert EscalationDispatcher(FileNotifier(str(log_path)), db_path).dispatch_pending() == 1
+
+    alert = json.loads(log_path.read_text().strip())
+    assert alert['escalation_id'] == escalation_id
+    assert alert['emergency_phone'] == '+911234567890'
+    sent = row(db_path, escalation_id)
+    assert sent['status'] == 'sent'
+    assert sent['attempts'] == 1
+    assert sent['sent_at'] is not None
+
+    # Nothing left to send
+    assert EscalationDispatcher(FileNotifier(str(log_path)), db_path).dispatch_pending() == 0
+
+
+def test_failed_send_backs_off_exponentially(db_path):
+    escalation_id = enqueue(db_path, 1, 10)
+    dispatcher = EscalationDispatcher(FlakyNotifier(failures=2), db_path)
+
+    before = time.time()
+    assert dispatcher.dispatch_pending() == 0
+    first = row(db_path, escalation_id)
+    assert first['status'] == 'pending'
+    assert first['attempts'] == 1
+    assert first['last_error'] == 'webhook down'
+    assert first['next_attempt_at'] >= before + escalation.BASE_BACKOFF_SECONDS
+
+    # Not due yet
+    assert dispatcher.dispatch_pending() == 0
+    assert row(db_path, escalation_id)['attempts'] == 1
+
+    update(db_path, 'UPDATE escalations SET next_attempt_at = 0 WHERE id = ?', escalation_id)
+    before = time.time()
+    assert dispatcher.dispatch_pending() == 0
+    second = row(db_path, escalation_id)
+    assert second['attempts'] == 2
+    assert second['next_attempt_at'] >= before + escalation.BASE_BACKOFF_SECONDS * 2
+
+    update(db_path, 'UPDATE escalations SET next_attempt_at = 0 WHERE id = ?', escalation_id)
+    assert dispatcher.dispatch_pending() == 1
+    sent = row(db_path, escalation_id)
+    assert sent['status'] == 'sent'
+    assert sent['attempts'] == 3
+    assert sent['last_error'] is None
+
+
+def test_gives_up_after_max_attempts(db_path, monkeypatch):
+    monkeypatch.setattr(escalation, 'MAX_ATTEMPTS', 2)
+    escalation_id = enqueue(db_path, 1, 10)
+    dispatcher = EscalationDispatcher(FlakyNotifier(failures=10), db_path)
+
+    dispatcher.dispatch_pending()
+    update(db_path, 'UPDATE escalations SET next_attempt_at = 0 WHERE id = ?', escalation_id)
+    dispatcher.dispatch_pending()
+    assert row(db_path, escalation_id)['status'] == 'failed'
+
+    update(db_path, 'UPDATE escalations SET next_attempt_at = 0 WHERE id = ?', escalation_id)
+    dispatcher.dispatch_pending()
+    assert row(db_path, escalation_id)['attempts'] == 2
+
+
+def test_claimed_row_is_left_until_its_lease_expires(db_path):
+    escalation_id = enqueue(db_path, 1, 10)
+    notifier = FlakyNotifier(failures=0)
+    dispatcher = EscalationDispatcher(notifier, db_path)
+
+    # Another worker claimed it just now
+    update(db_path, "UPDATE escalations SET status = 'sending', claimed_at = ? WHERE id = ?", time.time(), escalation_id)
+    assert dispatcher.dispatch_pending() == 0
+    assert notifier.sent == []
+
+    # That worker died; once the lease runs out the row is retried
+    update(db_path, 'UPDATE escalations SET claimed_at = ? WHERE id = ?',
+           time.time() - escalation.LEASE_SECONDS - 1, escalation_id)
+    assert dispatcher.dispatch_pending() == 1
+    assert [alert['escalation_id'] for alert in notifier.sent] == [escalation_id]
+
+
+def test_without_notifier_alerts_stay_pending(db_path):
+    escalation_id = enqueue(db_path, 1, 10)
+    assert EscalationDispatcher(None, db_path).dispatch_pending() == 0
+    assert row(db_path, escalation_id)['status'] == 'pending'
+
+
+def test_old_undelivered_alerts_go_stale_instead_of_sending(db_path):
+    old = enqueue(db_path, 1, 10)
+    update(db_path, "UPDATE escalations SET created_at = datetime('now', ?) WHERE id = ?",
+           f"-{escalation.STALE_AFTER_SECONDS + 60} seconds", old)
+
+    # Expired even while no notifier is configured
+    EscalationDispatcher(None, db_path).dispatch_pending()
+    assert row(db_path, old)['status'] == 'stale'
+
+    fresh = enqueue(db_path, 1, 11)
+    assert fresh is not None
+    notifier = FlakyNotifier(failures=0)
+    assert EscalationDispatcher(notifier, db_path).dispatch_pending() == 1
+    assert [alert['escalation_id'] for alert in notifier.sent] == [fresh]
+
+
+def test_notifier_from_env(monkeypatch):
+    monkeypatch.delenv('ESCALATION_NOTIFIER', raising=False)
+    assert notifier_from_env() is None
+
+    monkeypatch.setenv('ESCALATION_NOTIFIER', 'file:alerts.log')
+    notifier = notifier_from_env()
+    assert isinstance(notifier, FileNotifier) and notifier.path == 'alerts.log'
+
+    monkeypatch.setenv('ESCALATION_NOTIFIER', 'https://example.com/hook')
+    assert isinstance(notifier_from_env(), HttpNotifier)
+
+    monkeypatch.setenv('ESCALATION_NOTIFIER', 'smtp://example.com')
+    with pytest.raises(ValueError):
+        notifier_from_env()
@@ -0,0 +1,69 @@
+# test_priority_lane.py
+import threading
+
+import pytest
+
+from priority_lane import CRISIS, NORMAL, PriorityLane
+
+
+def blocked_lane():
+    """A lane whose worker is stuck on a first job until the returned event is set"""
+    lane = PriorityLane()
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    first = lane.submit(block)
+    assert started.wait(5)
+    return lane, release, first
+
+
+def test_crisis_jobs_run_before_queued_normal_jobs():
+    lane, release, first = blocked_lane()
+    order = []
+    futures = [lane.submit(order.append, f"normal-{i}") for i in range(3)]
+    futures.append(lane.submit(order.append, "crisis", priority=CRISIS))
+    futures.append(lane.submit(order.append, "normal-3", priority=NORMAL))
+
+    release.set()
+    for future in [first] + futures:
+        future.result(timeout=5)
+    assert order == ["crisis", "normal-0", "normal-1", "normal-2", "normal-3"]
+
+
+def test_depth_counts_waiting_jobs():
+    lane, release, first = blocked_lane()
+    futures = [lane.submit(lambda: None) for _ in range(4)]
+    assert lane.depth() == 4
+
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert lane.depth() == 0
+
+
+def test_cancelled_jobs_are_skipped():
+    lane, release, first = blocked_lane()
+    calls = []
+    cancelled = lane.submit(calls.append, "cancelled")
+    kept = lane.submit(calls.append, "kept")
+    assert cancelled.cancel()
+
+    release.set()
+    kept.result(timeout=5)
+    assert calls == ["kept"]
+
+
+def test_job_exception_reaches_the_caller():
+    lane = PriorityLane()
+
+    def fail():
+        raise RuntimeError("classifier crashed")
+
+    with pytest.raises(RuntimeError, match="classifier crashed"):
+        lane.submit(fail).result(timeout=5)
+    # The worker keeps going afterwards
+    assert lane.submit(lambda: 42).result(timeout=5) == 42
@@ -0,0 +1,60 @@
+# test_users.py
+import sqlite3
+
+import pytest
+
+from users import UserDirectory
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'users.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE consent (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE,
+            accepted BOOLEAN DEFAULT FALSE,
+            emergency_phone TEXT,
+            accepted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_repeat_logins_keep_ids_dense(db_path):
+    directory = UserDirectory(db_path)
+    assert [directory.login(email) for email in ('a@x', 'a@x', 'a@x', 'b@x')] == [1, 1, 1, 2]
+
+
+def test_consent_from_another_worker_is_seen(db_path):
+    # Two directories on one database stand in for two worker processes
+    worker_a, worker_b = UserDirectory(db_path), UserDirectory(db_path)
+    user_id = worker_a.login('a@x')
+    assert not worker_a.has_consented(user_id)
+
+    worker_b.record_consent(user_id, '+911')
+    assert worker_a.has_consented(user_id)
+    assert worker_a.get_emergency_phone(user_id) == '+911'
+
+    worker_b.record_consent(user_id, '+922')
+    assert worker_a.get_emergency_phone(user_id) == '+922'
+
+
+def test_caches_are_bounded(db_path):
+    directory = UserDirectory(db_path, max_entries=2)
+    ids = [directory.login(f'{n}@x') for n in range(4)]
+    for user_id in ids:
+        directory.record_consent(user_id, None)
+    assert list(directory._known_users) == ids[-2:]
+    assert list(directory._consent) == ids[-2:]
+    assert directory.has_consented(ids[0])
@@ -0,0 +1,51 @@
+# text_processing.py
+
+
+class ProcessedMessage:
+    """A message with everything analyzers share, each derived at most once.
+
+    The lowercased text is built up front; the spaCy Doc and VADER scores
+    are computed on first use. Analyzers record their keyword matches
+    in keyword_hits so later analyzers and reply generators can reuse them.
+    """
+
+    __slots__ = ('text', 'lower', 'keyword_hits', '_nlp', '_sentiment_analyzer',
+                 '_doc', '_sentiment_scores')
+
+    def __init__(self, text, nlp=None, sentiment_analyzer=None):
+        self.text = text or ''
+        self.lower = self.text.lower()
+        self.keyword_hits = {}
+        self._nlp = nlp
+        self._sentiment_analyzer = sentiment_analyzer
+        self._doc = None
+        self._sentiment_scores = None
+
+    def __bool__(self):
+        return bool(self.text)
+
+    @property
+    def doc(self):
+        """spaCy Doc for the message, or None without a model"""
+        if self._doc is None and self._nlp and self.text.strip():
+            self._doc = self._nlp(self.text)
+        return self._doc
+
+    @property
+    def sentiment_scores(self):
+        """VADER polarity_scores for the message"""
+        if self._sentiment_scores is None:
+            self._sentiment_scores = self._sentiment_analyzer.polarity_scores(self.text)
+        return self._sentiment_scores
+
+    def contains_any(self, keywords):
+        """Check for any keyword as a substring of the lowercased text"""
+        lower = self.lower
+        return any(keyword in lower for keyword in keywords)
+
+    def original(self, start, end):
+        """Text from the original message for a span found in lower"""
+        # Lowercasing a few non-ASCII characters changes the length, so offsets may not line up
+        if len(self.lower) == len(self.text):
+            return self.text[start:end]
+        return None
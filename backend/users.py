@@ -0,0 +1,138 @@
+# users.py
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+class UserDirectory:
+    """User identity and consent lookups backed by an in-process cache.
+
+    Logins and consents go through single UPSERT statements and keep the
+    cache current, so per-message checks don't need a query. Only positive
+    answers are cached: consent can't be withdrawn, so they never go stale,
+    while "not yet" is re-checked so consent given through another worker
+    process is seen on the next message.
+    """
+
+    def __init__(self, db_path='mindpeers.db', max_entries=100000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # user_id -> (True, emergency_phone) for users who have consented
+        self._consent = OrderedDict()
+        # user_id -> True for ids known to exist
+        self._known_users = OrderedDict()
+        # Bumped on every consent write so a lookup that raced with it isn't cached
+        self._generation = 0
+
+    def login(self, email):
+        """Get or create the user with this email and return their id"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            c = conn.cursor()
+            # Any INSERT attempt advances the AUTOINCREMENT sequence, even one that
+            # conflicts, so only try it for emails that aren't registered yet
+            row = c.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+            if row is None:
+                row = c.execute('''
+                    INSERT INTO users (email) VALUES (?)
+                    ON CONFLICT(email) DO NOTHING
+                    RETURNING id
+                ''', (email,)).fetchone()
+                conn.commit()
+            if row is None:
+                # Another request registered the same email in between
+                row = c.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+            user_id = row[0]
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._store(self._known_users, user_id, True)
+        return user_id
+
+    def record_consent(self, user_id, emergency_phone):
+        """Accept consent for a user, replacing any earlier emergency contact"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            c = conn.cursor()
+            c.execute('''
+                INSERT INTO consent (user_id, accepted, emergency_phone, accepted_at)
+                VALUES (?, TRUE, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    accepted = TRUE,
+                    emergency_phone = excluded.emergency_phone,
+                    accepted_at = excluded.accepted_at
+            ''', (user_id, emergency_phone, datetime.now()))
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._generation += 1
+            self._store(self._consent, user_id, (True, emergency_phone or None))
+
+    def user_exists(self, user_id):
+        """Check that a user id belongs to a registered user"""
+        with self._lock:
+            if user_id in self._known_users:
+                self._known_users.move_to_end(user_id)
+                return True
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone()
+        finally:
+            conn.close()
+
+        if row:
+            with self._lock:
+                self._store(self._known_users, user_id, True)
+        return row is not None
+
+    def get_consent(self, user_id):
+        """Return (accepted, emergency_phone) for a user, or None if they never consented"""
+        with self._lock:
+            cached = self._consent.get(user_id)
+            if cached is not None:
+                self._consent.move_to_end(user_id)
+                return cached
+            generation = self._generation
+
+        consent = self._load_consent(user_id)
+        if consent and consent[0]:
+            with self._lock:
+                if generation == self._generation:
+                    self._store(self._consent, user_id, consent)
+        return consent
+
+    def has_consented(self, user_id):
+        consent = self.get_consent(user_id)
+        return bool(consent and consent[0])
+
+    def get_emergency_phone(self, user_id):
+        """Get the emergency contact a user consented to share.
+
+        Read from the database rather than the cache, since another worker
+        process may have recorded a new number.
+        """
+        consent = self._load_consent(user_id)
+        return consent[1] if consent and consent[0] else None
+
+    def _load_consent(self, user_id):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute(
+                'SELECT accepted, emergency_phone FROM consent WHERE user_id = ?',
+                (user_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return (bool(row[0]), row[1] or None) if row else None
+
+    def _store(self, cache, user_id, value):
+        cache[user_id] = value
+        cache.move_to_end(user_id)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)